@@ -5,6 +5,7 @@ from django.contrib import admin
 from django.contrib.admin import ModelAdmin 
 
 from csvimport.models import CSVImport
+from csvimport.rollback import rollback_import
 from csvimport.widgets import ErrorTextarea
 
 class CSVImportAdmin(ModelAdmin):
@@ -20,6 +21,7 @@ class CSVImportAdmin(ModelAdmin):
         # just the error log field
         models.TextField: {'widget': ErrorTextarea()},
         }
+    actions = ['rollback']
 
     def save_model(self, request, obj, form, change):
         """ Do save and process command - cant commit False
@@ -36,7 +38,11 @@ class CSVImportAdmin(ModelAdmin):
                       modelname=obj.model_name,
                       charset='',
                       uploaded=obj.upload_file,
-                      defaults=defaults)
+                      defaults=defaults,
+                      database=obj.database,
+                      lookup_database=obj.lookup_database,
+                      consistent=True,
+                      journal=True)
         errors = cmd.run(logid=obj.id)
         if errors:
             obj.error_log = '\n'.join(errors)
@@ -44,6 +50,13 @@ class CSVImportAdmin(ModelAdmin):
         obj.import_date = datetime.now()
         obj.save()
 
+    def rollback(self, request, queryset):
+        """ Undo the selected imports from their journals """
+        for obj in queryset:
+            for msg in rollback_import(obj):
+                self.message_user(request, msg)
+    rollback.short_description = 'Roll back the selected imports'
+
     def filename_defaults(self, filename):
         """ Override this method to supply filename based data """
         defaults = []
@@ -0,0 +1,97 @@
+""" Batch size tuning for the import writer, driven by write latency """
+import time
+
+# Messages of lock waits, deadlocks and serialization failures
+LOCK_ERRORS = ('database is locked', 'database table is locked',
+               'lock wait timeout', 'deadlock', 'could not obtain lock',
+               'could not serialize')
+# MySQL error codes for a lock wait timeout and a deadlock
+LOCK_CODES = (1205, 1213)
+
+def is_lock_error(err):
+    """ Guess from a database error whether it was a lock wait """
+    args = getattr(err, 'args', ())
+    if args and args[0] in LOCK_CODES:
+        return True
+    msg = str(err).lower()
+    for text in LOCK_ERRORS:
+        if text in msg:
+            return True
+    return False
+
+class BatchTuner(object):
+    """ Pick the number of rows to write per transaction
+
+        Start at size and keep doubling it while the time per row improves,
+        halving it when the time per row gets worse, a batch is slower than
+        slow seconds, or a lock wait is hit. If autotune is False the size
+        stays fixed. A maxrate of rows per second throttles the writes
+        by sleeping between batches.
+    """
+
+    def __init__(self, size=100, autotune=False, minsize=1, maxsize=10000,
+                 slow=2.0, tolerance=0.1, maxrate=0,
+                 clock=time.time, sleep=time.sleep):
+        self.size = max(int(size), 1)
+        self.autotune = autotune
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.slow = slow
+        self.tolerance = tolerance
+        self.maxrate = maxrate
+        self.clock = clock
+        self.sleep = sleep
+        self.last = None
+        self.rows = 0
+        self.started = None
+        self.history = []
+
+    def start(self):
+        """ Start the clock for the rate throttle """
+        self.started = self.clock()
+        self.rows = 0
+
+    def grow(self):
+        self.size = min(self.size * 2, self.maxsize)
+
+    def shrink(self):
+        self.size = max(self.size // 2, self.minsize)
+
+    def record(self, rows, seconds):
+        """ Note how long a batch of rows took to write and
+            adjust the size for the next batch
+        """
+        self.history.append((rows, seconds))
+        if not rows:
+            return self.size
+        per_row = float(seconds) / rows
+        if self.autotune:
+            if seconds > self.slow:
+                self.shrink()
+            elif self.last is None or per_row <= self.last * (1 - self.tolerance):
+                self.grow()
+            elif per_row > self.last * (1 + self.tolerance):
+                self.shrink()
+        self.last = per_row
+        return self.size
+
+    def locked(self):
+        """ A batch hit a lock wait so back off """
+        if self.autotune:
+            self.shrink()
+            self.last = None
+        return self.size
+
+    def throttle(self, rows):
+        """ Sleep long enough to keep under maxrate rows per second """
+        now = self.clock()
+        if self.started is None:
+            self.started = now
+        self.rows += rows
+        if not self.maxrate:
+            return 0
+        wait = self.started + float(self.rows) / self.maxrate - now
+        if wait > 0:
+            self.sleep(wait)
+            return wait
+        return 0
@@ -0,0 +1,160 @@
+""" Relax foreign key checks and secondary indexes for bulk loads
+    into empty tables, then rebuild and verify them afterwards
+"""
+import re
+
+from django.core.management.color import no_style
+from django.db import connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+
+from csvimport.indexes import match_plan, match_fields
+
+INDEX_NAME = re.compile(r'CREATE INDEX (\S+) ON', re.I)
+
+def matched_columns(targets):
+    """ (model, column) of the fields the rows of each (model, mappings)
+        target are matched on, down through its foreign keys
+    """
+    columns = set()
+    for model, mappings in targets:
+        for lookup_model, names in match_plan(model, mappings):
+            for field in match_fields(lookup_model, names):
+                columns.add((lookup_model, field.column))
+    return columns
+
+class BulkLoad(object):
+    """ Switch off foreign key checks and drop the non-unique indexes
+        of the models for the load, with finish putting them back and
+        checking for foreign keys with no matching parent row.
+
+        SQLite and MySQL switch fk checks off for the connection.
+        PostgreSQL defers the constraints to commit, which only lasts for
+        a transaction, so defer is called at the start of each one.
+        Only indexes django creates for db_index fields are dropped, and
+        not those over keep, the (model, column) rows are matched on -
+        as each row is still looked up on them.
+    """
+
+    def __init__(self, models, using=DEFAULT_DB_ALIAS, keep=()):
+        self.models = models
+        self.using = using
+        self.keep = set(keep)
+        self.connection = connections[using]
+        self.dropped = []
+        self.fk_checks = None
+
+    def execute(self, sql):
+        cursor = self.connection.cursor()
+        cursor.execute(sql)
+        return cursor
+
+    def start(self):
+        """ Relax the checks, returning messages for the import log """
+        messages = []
+        vendor = self.connection.vendor
+        if vendor == 'sqlite':
+            row = self.execute('PRAGMA foreign_keys').fetchone()
+            self.fk_checks = row and row[0]
+            self.execute('PRAGMA foreign_keys = OFF')
+        elif vendor == 'mysql':
+            self.fk_checks = self.execute(
+                'SELECT @@FOREIGN_KEY_CHECKS').fetchone()[0]
+            self.execute('SET FOREIGN_KEY_CHECKS = 0')
+        self.defer()
+        for model in self.models:
+            for sql, name in self.index_sql(model):
+                sid = transaction.savepoint(using=self.using)
+                try:
+                    self.execute(self.drop_sql(model, name))
+                except DatabaseError, err:
+                    transaction.savepoint_rollback(sid, using=self.using)
+                    messages.append('Could not drop index %s (%s)' % (name,
+                                                                      err))
+                    continue
+                transaction.savepoint_commit(sid, using=self.using)
+                self.dropped.append((model, name, sql))
+        transaction.commit_unless_managed(using=self.using)
+        if self.dropped:
+            messages.append('Bulk load dropped indexes %s' % ', '.join(
+                [name for model, name, sql in self.dropped]))
+        return messages
+
+    def defer(self):
+        """ Defer fk constraints to commit for the current transaction """
+        if self.connection.vendor == 'postgresql':
+            self.execute('SET CONSTRAINTS ALL DEFERRED')
+
+    def index_sql(self, model):
+        """ (CREATE INDEX statement, index name) for non-unique indexes """
+        statements = []
+        creation = self.connection.creation
+        for field in model._meta.local_fields:
+            # mysql needs the index for the fk constraint
+            if field.rel and self.connection.vendor == 'mysql':
+                continue
+            if (model, field.column) in self.keep:
+                continue
+            for sql in creation.sql_indexes_for_field(model, field,
+                                                      no_style()):
+                match = INDEX_NAME.search(sql)
+                if match:
+                    statements.append((sql.rstrip(';'), match.group(1)))
+        return statements
+
+    def drop_sql(self, model, name):
+        sql = 'DROP INDEX %s' % name
+        if self.connection.vendor == 'mysql':
+            sql += ' ON %s' % self.connection.ops.quote_name(
+                model._meta.db_table)
+        return sql
+
+    def finish(self):
+        """ Rebuild the indexes, switch fk checks back on and
+            return messages for any rows that fail the fk checks
+        """
+        messages = []
+        try:
+            for model, name, sql in self.dropped:
+                self.execute(sql)
+            if self.dropped:
+                messages.append('Bulk load rebuilt indexes %s' % ', '.join(
+                    [name for model, name, sql in self.dropped]))
+            self.dropped = []
+        finally:
+            # even if a rebuild fails, so the connection is not left
+            # without fk checks
+            vendor = self.connection.vendor
+            if vendor == 'sqlite' and self.fk_checks is not None:
+                self.execute('PRAGMA foreign_keys = %d' % self.fk_checks)
+            elif vendor == 'mysql' and self.fk_checks is not None:
+                self.execute('SET FOREIGN_KEY_CHECKS = %d' % self.fk_checks)
+            self.fk_checks = None
+        transaction.commit_unless_managed(using=self.using)
+        for model in self.models:
+            messages.extend(self.verify(model))
+        return messages
+
+    def verify(self, model, examples=5):
+        """ Report rows whose foreign keys have no matching parent row """
+        messages = []
+        qn = self.connection.ops.quote_name
+        for field in model._meta.local_fields:
+            if not field.rel:
+                continue
+            parent = field.rel.to
+            parent_column = parent._meta.get_field(field.rel.field_name).column
+            sql = ('SELECT child.%s, child.%s FROM %s child LEFT JOIN %s parent'
+                   ' ON child.%s = parent.%s WHERE child.%s IS NOT NULL'
+                   ' AND parent.%s IS NULL' % (
+                       qn(model._meta.pk.column), qn(field.column),
+                       qn(model._meta.db_table), qn(parent._meta.db_table),
+                       qn(field.column), qn(parent_column),
+                       qn(field.column), qn(parent_column)))
+            rows = self.execute(sql).fetchall()
+            if rows:
+                messages.append('Bulk load check: %s %s rows have %s values'
+                                ' missing from %s, eg. %s' % (
+                                    len(rows), model.__name__, field.name,
+                                    parent.__name__,
+                                    ', '.join(['%s=%s' % (pk, value) for
+                                               pk, value in rows[:examples]])))
+        return messages
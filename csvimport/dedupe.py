@@ -0,0 +1,101 @@
+""" Collapse rows that repeat the same match key within a file """
+from itertools import groupby
+from hashlib import md5
+
+from csvimport.sorting import ExternalSort
+
+RULES = ('first', 'last', 'merge')
+
+class NoSuchRule(Exception):
+    pass
+
+def merge_rows(rows):
+    """ Later non-empty cells replace earlier ones, which is what
+        saving each of the rows in turn over the same instance gives
+    """
+    merged = list(rows[0])
+    for row in rows[1:]:
+        for i, cell in enumerate(row):
+            if cell == '':
+                continue
+            if i < len(merged):
+                merged[i] = cell
+            else:
+                merged.append(cell)
+    return merged
+
+class Collapser(object):
+    """ Collapse (row_ind, row) items with the same key to one item
+
+        first - keep the first row, using a set of key digests so rows
+                are passed on as they are read
+        last  - keep the last row
+        merge - merge the rows in file order, see merge_rows
+        last and merge group the rows with an external sort so are not
+        limited by memory, then sort them back to file order.
+        Rows whose key cells are all empty are passed on as they are,
+        since they would not be matched to each other when saved.
+    """
+
+    def __init__(self, key, rule='first', buffersize=64 * 1024 * 1024):
+        if rule not in RULES:
+            raise NoSuchRule('Collapse rule must be one of %s not %s' % (
+                             ', '.join(RULES), rule))
+        self.key = key
+        self.rule = rule
+        self.buffersize = buffersize
+        self.duplicates = 0
+        self.keys = 0
+
+    def collapse(self, items):
+        if self.rule == 'first':
+            return self.first(items)
+        return self.grouped(items)
+
+    def digest(self, item):
+        return md5(repr(self.key(item))).digest()
+
+    def blank(self, key):
+        if not isinstance(key, (list, tuple)):
+            key = [key]
+        return not [cell for cell in key if cell not in ('', None)]
+
+    def first(self, items):
+        seen = set()
+        counted = set()
+        for item in items:
+            if self.blank(self.key(item)):
+                yield item
+                continue
+            digest = self.digest(item)
+            if digest in seen:
+                self.duplicates += 1
+                if digest not in counted:
+                    counted.add(digest)
+                    self.keys += 1
+                continue
+            seen.add(digest)
+            yield item
+
+    def grouped(self, items):
+        by_key = ExternalSort(self.key, buffersize=self.buffersize)
+        collapsed = self.collapse_groups(groupby(by_key.sort(items),
+                                                 self.key))
+        by_row = ExternalSort(lambda item: item[0],
+                              buffersize=self.buffersize)
+        return by_row.sort(collapsed)
+
+    def collapse_groups(self, groups):
+        for key, group in groups:
+            if self.blank(key):
+                for item in group:
+                    yield item
+                continue
+            group = list(group)
+            if len(group) > 1:
+                self.duplicates += len(group) - 1
+                self.keys += 1
+            if self.rule == 'last' or len(group) == 1:
+                yield group[-1]
+            else:
+                yield (group[0][0], merge_rows([row for row_ind, row in group]))
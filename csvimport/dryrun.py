@@ -0,0 +1,280 @@
+""" Check an import without writing anything - map and clean the rows
+    across a process pool, then match them read-only a chunk at a time,
+    to report errors by column and the rows that would be inserted or
+    updated
+"""
+import multiprocessing
+
+from csvimport.joins import resolve
+
+# Rows sent to a worker process at a time, and matched per query
+DRY_CHUNK = 500
+# Example rows reported for each column
+EXAMPLES = 5
+
+# The DryRun being run, inherited by the forked worker processes
+_dryrun = None
+
+def tree_spec(leaf):
+    """ A TempModel tree as plain data that pickles cheaply, as
+        (model, [(field name, value)], [(field name, spec)]).
+        Many to many values are left out as they do not match rows.
+    """
+    return (leaf.get_model(),
+            [(field.name, value) for field, value in leaf.get_values()],
+            [(field.name, tree_spec(fk)) for field, fk in leaf.get_fks()])
+
+def clean_chunk(chunk):
+    """ Clean a chunk of rows in a worker process """
+    return [_dryrun.clean(item) for item in chunk]
+
+class Node(object):
+    """ A leaf of a row's tree, with what matching it found """
+
+    def __init__(self, target, row_ind, path, model, values, children):
+        self.target = target
+        self.row_ind = row_ind
+        self.path = path
+        self.model = model
+        self.values = values
+        self.children = children
+        self.height = max([child.height + 1 for name, child in children] or
+                          [0])
+        self.pk = None
+        self.new = None
+        self.failed = False
+
+class DryRun(object):
+    """ Run the command's mapping and cleaning over the rows, in a pool
+        of processes unless processes is 1, and match the rows on the
+        using database without saving them.
+
+        Matching mirrors tree_save - unique fields or failing that
+        required ones, foreign keys first - but looks up a chunk of rows
+        per query. A row that matches one created earlier in the file
+        counts as an update, as the import would match it by then.
+    """
+
+    def __init__(self, command, indexes, processes=0, using=None,
+                 chunksize=DRY_CHUNK):
+        self.command = command
+        self.indexes = indexes
+        self.processes = processes
+        self.using = using or command.database
+        self.chunksize = chunksize
+        self.targets = command.targets or [(command.model, command.mappings)]
+        self.rows = 0
+        self.errors = {}
+        self.error_order = []
+        self.counts = {}
+        self.count_order = []
+        self.created = set()
+
+    def clean(self, item):
+        """ Index, a spec per target and (column, message) errors of a row """
+        row_ind, row = item
+        errors = []
+        specs = []
+        try:
+            for model, mappings in self.targets:
+                specs.append(tree_spec(self.command.row_tree(
+                    row_ind, row, self.indexes, [], model,
+                    mappings or self.command.mappings, errors=errors)))
+        except IndexError:
+            errors.append((None, 'Row has too few columns'))
+            specs = []
+        return row_ind, specs, errors
+
+    def chunks(self, items):
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= self.chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def cleaned(self, items):
+        """ Cleaned chunks of rows, in file order """
+        global _dryrun
+        if self.processes == 1:
+            for chunk in self.chunks(items):
+                yield [self.clean(item) for item in chunk]
+            return
+        _dryrun = self
+        pool = multiprocessing.Pool(self.processes or None)
+        try:
+            for chunk in pool.imap(clean_chunk, self.chunks(items)):
+                yield chunk
+        finally:
+            pool.terminate()
+            _dryrun = None
+
+    def check(self, items):
+        """ Check the (row_ind, row) items, returning the report """
+        for chunk in self.cleaned(items):
+            nodes = []
+            for row_ind, specs, errors in chunk:
+                self.rows += 1
+                for column, msg in errors:
+                    self.error(column, row_ind, msg)
+                for target, spec in enumerate(specs):
+                    self.walk(target, row_ind, (), spec, nodes)
+            self.match(nodes)
+        return self.report()
+
+    def walk(self, target, row_ind, path, spec, nodes):
+        """ Add the spec's nodes to nodes, children first """
+        model, values, fks = spec
+        children = [(name, self.walk(target, row_ind, path + (name, ), fk,
+                                     nodes))
+                    for name, fk in fks]
+        node = Node(target, row_ind, path, model, values, children)
+        nodes.append(node)
+        return node
+
+    def match(self, nodes):
+        """ Match the nodes a level at a time from the bottom, with one
+            query per model and set of match fields at each level
+        """
+        for height in sorted(set([node.height for node in nodes])):
+            groups = {}
+            order = []
+            for node in nodes:
+                if node.height != height:
+                    continue
+                lookups, key, new_fk = self.match_key(node)
+                if node.failed:
+                    self.count(node.model, 'failures')
+                elif lookups is None:
+                    # nothing to match on so a row is always created
+                    node.new = (node.model, node.row_ind, node.path)
+                    self.count(node.model, 'inserts')
+                elif new_fk:
+                    # only a row created by the import could match
+                    self.settle(node, lookups, key, [])
+                else:
+                    if (node.model, lookups) not in groups:
+                        groups[(node.model, lookups)] = []
+                        order.append((node.model, lookups))
+                    groups[(node.model, lookups)].append((node, key))
+            for model, lookups in order:
+                group = groups[(model, lookups)]
+                found = resolve(model, lookups, [key for node, key in group],
+                                using=self.using)
+                for node, key in group:
+                    self.settle(node, lookups, key, found.get(key, []))
+
+    def match_key(self, node):
+        """ (field names, values, whether a value is a row the import
+            creates) to match the node on, as TempModel.match_dict does
+        """
+        meta = node.model._meta
+        unique = []
+        required = []
+        new_fk = False
+        for name, value in node.values:
+            field = meta.get_field(name)
+            # as the database would compare it, eg. a date not a datetime
+            value = field.get_prep_value(value)
+            if field.unique:
+                unique.append((name, value))
+            elif not field.blank:
+                required.append((name, value))
+        linked = []
+        for name, child in node.children:
+            if child.failed:
+                continue
+            field = meta.get_field(name)
+            linked.append(name)
+            if child.pk is not None:
+                value = child.pk
+            else:
+                value = child.new
+                new_fk = True
+            if field.unique:
+                unique.append((name, value))
+            elif not field.blank:
+                required.append((name, value))
+        for field in meta.fields:
+            if field.rel and not field.null and field.name not in linked:
+                node.failed = True
+                self.error(self.columns(node), node.row_ind,
+                           '%s %s is required but not set' % (
+                               node.model.__name__, field.name))
+        matched = sorted(unique or required)
+        if not matched:
+            return None, None, False
+        return (tuple([name for name, value in matched]),
+                tuple([value for name, value in matched]), new_fk)
+
+    def settle(self, node, lookups, key, pks):
+        if len(pks) > 1:
+            node.failed = True
+            self.count(node.model, 'failures')
+            self.error(self.columns(node), node.row_ind,
+                       '%s %s match %s %s rows' % (
+                           ', '.join(lookups), key, len(pks),
+                           node.model.__name__))
+        elif pks:
+            node.pk = pks[0]
+            self.count(node.model, 'updates')
+        else:
+            node.new = (node.model, lookups, key)
+            if node.new in self.created:
+                self.count(node.model, 'updates')
+            else:
+                self.created.add(node.new)
+                self.count(node.model, 'inserts')
+
+    def columns(self, node):
+        """ Columns, 0 based, mapped to the node or below it, or for
+            the row's own model its name
+        """
+        if not node.path:
+            return node.model.__name__
+        mappings = self.targets[node.target][1] or self.command.mappings
+        columns = []
+        for field_names, column in mappings:
+            names = [name for name in field_names if not name.isdigit()]
+            if tuple(names[:len(node.path)]) == node.path:
+                columns.append(self.command.column_index(column,
+                                                         self.indexes))
+        return tuple(columns)
+
+    def error(self, column, row_ind, msg):
+        if column not in self.errors:
+            self.errors[column] = [0, []]
+            self.error_order.append(column)
+        self.errors[column][0] += 1
+        if len(self.errors[column][1]) < EXAMPLES:
+            self.errors[column][1].append('row %s %s' % (row_ind + 1, msg))
+
+    def count(self, model, outcome):
+        if model not in self.counts:
+            self.counts[model] = {'inserts': 0, 'updates': 0, 'failures': 0}
+            self.count_order.append(model)
+        self.counts[model][outcome] += 1
+
+    def report(self):
+        messages = ['Dry run of %s rows, nothing was saved' % self.rows]
+        for column in self.error_order:
+            if column is None:
+                label = 'Rows'
+            elif isinstance(column, basestring):
+                label = column
+            elif isinstance(column, tuple):
+                label = 'Columns %s' % ', '.join([str(col + 1)
+                                                  for col in column])
+            else:
+                label = 'Column %s' % (column + 1)
+            count, examples = self.errors[column]
+            messages.append('%s: %s errors, eg. %s' % (label, count,
+                                                       '; '.join(examples)))
+        for model in self.count_order:
+            counts = self.counts[model]
+            messages.append('%s: %s inserts, %s updates, %s failures' % (
+                model.__name__, counts['inserts'], counts['updates'],
+                counts['failures']))
+        return messages
@@ -0,0 +1,128 @@
+""" Read the rows appended to a growing CSV file since a byte offset,
+    for imports that follow the file rather than reading all of it
+
+    Waiting for the file to change uses inotify if pyinotify is
+    installed, otherwise the file size is polled.
+"""
+import os
+import csv
+import time
+from cStringIO import StringIO
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# Bytes read at a time, so a large file is imported in chunks
+FOLLOW_CHUNK = 4 * 1024 * 1024
+
+class FollowReader(object):
+    """ Complete rows of the file after offset, as lists of unicode cells,
+        read about chunksize bytes at a time
+
+        A last line with no line ending, or a quoted cell still open at
+        the end, is left for the next read - so offset only ever moves
+        past whole rows. seen is the file size at the last read.
+    """
+
+    def __init__(self, path, offset=0, charset='utf-8', dialect=csv.excel,
+                 chunksize=FOLLOW_CHUNK):
+        self.path = path
+        self.offset = offset
+        self.charset = charset
+        self.dialect = dialect
+        self.chunksize = chunksize
+        self.seen = offset
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def truncated(self):
+        """ Whether the file is shorter than the offset, eg. replaced """
+        return self.size() < self.offset
+
+    def read_data(self, size):
+        filehandle = open(self.path, 'rb')
+        try:
+            self.seen = os.fstat(filehandle.fileno()).st_size
+            filehandle.seek(self.offset)
+            return filehandle.read(size)
+        finally:
+            filehandle.close()
+
+    def read(self):
+        """ Return the rows in the next chunk and move offset to the end
+            of the last - reading more than a chunk if a row is longer
+        """
+        size = self.chunksize
+        while True:
+            data = self.read_data(size)
+            rows, consumed = self.parse(data)
+            if consumed or len(data) < size:
+                break
+            size *= 2
+        self.offset += consumed
+        return rows
+
+    def parse(self, data):
+        """ The complete rows in data and the bytes they take up """
+        lines = data.splitlines(True)
+        if lines and not lines[-1].endswith(('\n', '\r')):
+            lines.pop()
+        state = {'consumed': 0, 'exhausted': False}
+
+        def feed():
+            for line in lines:
+                state['consumed'] += len(line)
+                yield line
+            state['exhausted'] = True
+
+        rows = []
+        consumed = 0
+        try:
+            for row in csv.reader(feed(), dialect=self.dialect):
+                # the csv reader only pulls lines until a row is complete,
+                # unless the data ran out in a quoted cell
+                if state['exhausted']:
+                    break
+                consumed = state['consumed']
+                if row:
+                    rows.append([unicode(cell, self.charset) for cell in row])
+        except csv.Error:
+            pass
+        return rows, consumed
+
+def wait_for_change(path, size, timeout):
+    """ Wait up to timeout seconds for the file size to change from
+        size, the size when it was last read, returning whether it has
+    """
+    if os.path.getsize(path) != size:
+        # changed since it was read
+        return True
+    if pyinotify is not None:
+        manager = pyinotify.WatchManager()
+        notifier = pyinotify.Notifier(manager, timeout=int(timeout * 1000))
+        manager.add_watch(path, pyinotify.IN_MODIFY | pyinotify.IN_CLOSE_WRITE)
+        try:
+            if notifier.check_events():
+                notifier.read_events()
+        finally:
+            notifier.stop()
+    else:
+        deadline = time.time() + timeout
+        while os.path.getsize(path) == size and time.time() < deadline:
+            time.sleep(min(1, timeout))
+    return os.path.getsize(path) != size
+
+def format_row(cells):
+    """ A row as a line of CSV text, to store the header """
+    line = StringIO()
+    csv.writer(line).writerow([cell.encode('utf-8') for cell in cells])
+    return line.getvalue().rstrip('\r\n').decode('utf-8')
+
+def parse_row(text):
+    """ Cells of a row stored with format_row """
+    for row in csv.reader([text.encode('utf-8')]):
+        return [unicode(cell, 'utf-8') for cell in row]
+    return []
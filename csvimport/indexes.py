@@ -0,0 +1,209 @@
+""" Check the columns the importer matches rows on are indexed,
+    and optionally add temporary indexes over them for the import
+"""
+import random
+from hashlib import md5
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.backends.util import truncate_name
+from django.db.models.fields import FieldDoesNotExist
+
+# Temporary indexes are named with this prefix, kept when the name is
+# truncated, so one import never takes another's for its own
+TEMP_PREFIX = 'csvimport_tmp_'
+
+def match_plan(model, mappings):
+    """ The models looked up for each row, with the field names set on
+        them - so for column1=org.name, Item is matched on org and
+        Organisation on name. Returns a list of (model, field names).
+    """
+    plan = {}
+    order = []
+
+    def add(path, model, name):
+        if path not in plan:
+            plan[path] = (model, [])
+            order.append(path)
+        if name not in plan[path][1]:
+            plan[path][1].append(name)
+
+    for field_names, column in mappings:
+        current = model
+        path = ()
+        names = list(field_names)
+        while names:
+            name = names.pop(0)
+            add(path, current, name)
+            if not names:
+                break
+            try:
+                field = current._meta.get_field(name)
+            except FieldDoesNotExist:
+                break
+            if not field.rel:
+                break
+            path = path + (name, )
+            if names[0].isdigit():
+                # m2m index
+                path = path + (names.pop(0), )
+            current = field.rel.to
+    return [plan[path] for path in order]
+
+def match_fields(model, names):
+    """ Fields fetch_for_values matches on out of those set, the
+        unique fields or failing that the required ones
+    """
+    unique = []
+    required = []
+    for name in names:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.get_internal_type() == 'ManyToManyField':
+            continue
+        if field.unique:
+            unique.append(field)
+        elif not field.blank:
+            required.append(field)
+    return unique or required
+
+def table_indexes(model, using=DEFAULT_DB_ALIAS):
+    """ Name and columns of each index on the model's table in the
+        database, so indexes added by hand are seen as well
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    indexes = []
+    if connection.vendor == 'sqlite':
+        # its get_indexes lists every column, indexed or not. The pragma
+        # functions are selected from as a PRAGMA statement would commit
+        cursor.execute("""
+            SELECT il.name, ii.name
+            FROM pragma_index_list(%s) il, pragma_index_info(il.name) ii
+            ORDER BY il.seq, ii.seqno""", [table])
+        columns = {}
+        for name, column in cursor.fetchall():
+            if name not in columns:
+                columns[name] = []
+                indexes.append((name, columns[name]))
+            columns[name].append(column)
+    elif connection.vendor == 'mysql':
+        cursor.execute('SHOW INDEX FROM %s' % quote(table))
+        columns = {}
+        # Key_name, Seq_in_index, Column_name
+        for row in sorted(cursor.fetchall(), key=lambda row: row[3]):
+            if row[2] not in columns:
+                columns[row[2]] = []
+                indexes.append((row[2], columns[row[2]]))
+            columns[row[2]].append(row[4])
+    elif connection.vendor == 'postgresql':
+        # get_indexes skips indexes over more than one column
+        cursor.execute("""
+            SELECT attr.attnum, attr.attname
+            FROM pg_catalog.pg_class c, pg_catalog.pg_attribute attr
+            WHERE attr.attrelid = c.oid AND attr.attnum > 0
+                AND c.relname = %s""", [table])
+        names = dict(cursor.fetchall())
+        cursor.execute("""
+            SELECT c2.relname, idx.indkey
+            FROM pg_catalog.pg_class c, pg_catalog.pg_class c2,
+                pg_catalog.pg_index idx
+            WHERE c.oid = idx.indrelid AND idx.indexrelid = c2.oid
+                AND c.relname = %s""", [table])
+        for name, indkey in cursor.fetchall():
+            # expressions have attnum 0
+            indexes.append((name, [names.get(int(attnum)) for attnum in
+                                   str(indkey).split()]))
+    else:
+        # only the columns are known, so name each index after its column
+        for column in connection.introspection.get_indexes(cursor, table):
+            indexes.append((column, [column]))
+    return indexes
+
+def indexed_columns(model, using=DEFAULT_DB_ALIAS):
+    """ Leading columns of the model's indexes, taken from its fields
+        and the database - bar the temporary indexes of other imports,
+        which are dropped when they finish
+    """
+    columns = set()
+    for field in model._meta.fields:
+        if field.primary_key or field.unique or field.db_index:
+            columns.add(field.column)
+    for names in model._meta.unique_together:
+        columns.add(model._meta.get_field(names[0]).column)
+    for name, index_columns in table_indexes(model, using):
+        if index_columns and not name.startswith(TEMP_PREFIX):
+            columns.add(index_columns[0])
+    return columns
+
+def advise(model, mappings, using=DEFAULT_DB_ALIAS):
+    """ Return (model, fields, message) for each model looked up that
+        would be matched on unindexed columns, and so scan the table
+    """
+    advice = []
+    for lookup_model, names in match_plan(model, mappings):
+        fields = match_fields(lookup_model, names)
+        if not fields or fields[0].unique:
+            continue
+        indexed = indexed_columns(lookup_model, using)
+        if [field for field in fields if field.column in indexed]:
+            continue
+        table = lookup_model._meta.db_table
+        columns = [field.column for field in fields]
+        msg = ('%s rows are matched on %s but none of them are indexed, so'
+               ' each row scans the table. Consider db_index=True on one of'
+               ' them or CREATE INDEX %s ON %s (%s)' % (
+                   lookup_model.__name__,
+                   ', '.join([field.name for field in fields]),
+                   index_name(table, columns), table, ', '.join(columns)))
+        advice.append((lookup_model, fields, msg))
+    return advice
+
+def index_name(table, columns):
+    digest = md5(','.join(columns)).hexdigest()[:8]
+    return '%s_csvimport_%s' % (table, digest)
+
+def temp_index_name(table, columns, token):
+    """ Name of an import's temporary index, unique to its token """
+    digest = md5(','.join(columns + [token])).hexdigest()[:8]
+    return '%s%s_%s' % (TEMP_PREFIX, digest, table)
+
+def create_index(model, fields, using=DEFAULT_DB_ALIAS, token=None):
+    """ Add a temporary index over the fields' columns, returning its
+        name. Imports running at once pass different tokens, so each
+        adds and drops its own index.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    if token is None:
+        token = '%08x' % random.getrandbits(32)
+    name = truncate_name(temp_index_name(table, [field.column for field
+                                                 in fields], token),
+                         connection.ops.max_name_length())
+    columns = []
+    for field in fields:
+        column = quote(field.column)
+        if connection.vendor == 'mysql' and \
+           field.get_internal_type() == 'TextField':
+            # mysql can only index a prefix of text columns
+            column += '(255)'
+        columns.append(column)
+    cursor = connection.cursor()
+    cursor.execute('CREATE INDEX %s ON %s (%s)' % (quote(name), quote(table),
+                                                   ', '.join(columns)))
+    transaction.commit_unless_managed(using=using)
+    return name
+
+def drop_index(model, name, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    sql = 'DROP INDEX %s' % quote(name)
+    if connection.vendor == 'mysql':
+        sql += ' ON %s' % quote(model._meta.db_table)
+    cursor = connection.cursor()
+    cursor.execute(sql)
+    transaction.commit_unless_managed(using=using)
@@ -0,0 +1,52 @@
+""" Resolve read-only chains of foreign keys, eg. column3=fk1.fk2.field,
+    with one joined query for many rows rather than a lookup per hop
+"""
+from django.db import DEFAULT_DB_ALIAS
+
+def chain_lookups(leaf):
+    """ For a leaf that only sets one foreign key, leading through more
+        such leaves to one that only sets values, return the lookups from
+        the leaf's model and the values - else None.
+        So fk1.fk2.name gives (('fk2__name', ), (value, )) for the fk1 leaf.
+    """
+    if leaf.get_values() or len(leaf.get_fks()) != 1:
+        return None
+    path = []
+    while True:
+        if leaf.get_m2ms():
+            return None
+        values = leaf.get_values()
+        fks = leaf.get_fks()
+        if fks:
+            if values or len(fks) != 1:
+                return None
+            field, leaf = fks[0]
+            path.append(field.name)
+            continue
+        if not values:
+            return None
+        values = sorted(values, key=lambda item: item[0].name)
+        lookups = tuple(['__'.join(path + [field.name])
+                         for field, value in values])
+        # as the database gives them back, eg. a date not a datetime
+        return lookups, tuple([field.get_prep_value(value)
+                               for field, value in values])
+
+def resolve(model, lookups, keys, using=DEFAULT_DB_ALIAS):
+    """ Map each key, a tuple of values for the lookups, to the primary
+        keys of the model's rows that match it, with one joined query
+    """
+    found = {}
+    keys = set(keys)
+    if not keys:
+        return found
+    filters = {}
+    for i, lookup in enumerate(lookups):
+        filters[lookup + '__in'] = list(set([key[i] for key in keys]))
+    rows = model._default_manager.using(using).filter(**filters)
+    for row in rows.values_list('pk', *lookups):
+        key = tuple(row[1:])
+        # the __in filters can match combinations no row asked for
+        if key in keys:
+            found.setdefault(key, []).append(row[0])
+    return found
@@ -0,0 +1,48 @@
+""" Lock the match key of a row the import is about to create, so
+    imports running at once into the same model do not both create it
+
+    PostgreSQL uses transaction level advisory locks. Other databases
+    insert the key into the ImportLock table instead - its unique index
+    makes a second import inserting the same key wait for the first
+    to commit or roll back.
+"""
+import struct
+from binascii import hexlify
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+def lock_id(key):
+    """ Signed 64 bit advisory lock id for a match key digest """
+    return struct.unpack('>q', key[:8])[0]
+
+class KeyLocks(object):
+    """ Take locks on match keys on the using database, held until the
+        transaction they are taken in ends.
+
+        Take the lock when a lookup finds no row, then look up again
+        on the using database - another import may have created the
+        row while this one waited.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.acquired = 0
+
+    def acquire(self, key):
+        connection = connections[self.using]
+        cursor = connection.cursor()
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [lock_id(key)])
+        else:
+            from csvimport.models import ImportLock
+            meta = ImportLock._meta
+            quote = connection.ops.quote_name
+            table = quote(meta.db_table)
+            column = quote(meta.get_field('key').column)
+            # deleted again straight away, but the index entry stays
+            # locked so an insert of the key waits until this commits
+            cursor.execute('INSERT INTO %s (%s) VALUES (%%s)' % (table, column),
+                           [hexlify(key)])
+            cursor.execute('DELETE FROM %s WHERE %s = %%s' % (table, column),
+                           [hexlify(key)])
+        self.acquired += 1
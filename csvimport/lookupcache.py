@@ -0,0 +1,160 @@
+""" Keep the rows foreign keys resolve to in django's cache framework,
+    so later imports skip the lookups, with post_save, post_delete and
+    batch_saved clearing the entries for a row when it changes
+"""
+from hashlib import md5
+
+from django.conf import settings
+from django.db.models import get_model
+from django.db.models.signals import post_save, post_delete, class_prepared
+
+from csvimport.signals import batch_saved
+
+PREFIX = 'csvimport:lookup:'
+# A week, so nightly imports start warm
+TIMEOUT = 7 * 24 * 60 * 60
+
+_caches = {}
+# Models whose changes clear their rows' entries
+_connected = set()
+
+def get_lookup_cache(alias=None):
+    """ Cache backend for the alias, which defaults to the
+        CSVIMPORT_LOOKUP_CACHE setting, or None if neither is set
+    """
+    if alias is None:
+        alias = getattr(settings, 'CSVIMPORT_LOOKUP_CACHE', '')
+    if not alias:
+        return None
+    if alias not in _caches:
+        # imported here as loading the cache module sets up the default cache
+        from django.core.cache import get_cache
+        _caches[alias] = get_cache(alias)
+    return _caches[alias]
+
+def model_label(model):
+    return '%s.%s' % (model._meta.app_label, model.__name__)
+
+def row_key(model, using, pk):
+    """ Key listing the match keys cached for a row """
+    # unicode as aliases read back from the database are
+    return PREFIX + md5(repr((unicode(using), model_label(model),
+                              unicode(pk)))).hexdigest()
+
+class LookupCache(object):
+    """ Map a model's match lookups to the primary key of its row
+        on the using database.
+
+        Each row also has a key listing the match keys that point to it,
+        so invalidate can clear them when the row is saved or deleted -
+        for the models cached or looked up, see connect.
+        Queryset update() and delete() send no signals, so rows changed
+        that way can be cached stale until the entries time out.
+    """
+
+    def __init__(self, cache, using, timeout=None):
+        self.cache = cache
+        self.using = using
+        self.timeout = timeout or getattr(settings,
+                                          'CSVIMPORT_LOOKUP_CACHE_TIMEOUT',
+                                          TIMEOUT)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model, matchdict):
+        return PREFIX + md5(repr((unicode(self.using), model_label(model),
+                                  sorted(matchdict.items())))).hexdigest()
+
+    def get(self, model, matchdict):
+        """ Primary key cached for the lookups, or None """
+        connect(model)
+        pk = self.cache.get(self.key(model, matchdict))
+        if pk is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return pk
+
+    def set(self, model, matchdict, pk):
+        connect(model)
+        key = self.key(model, matchdict)
+        rkey = row_key(model, self.using, pk)
+        keys = self.cache.get(rkey) or []
+        if key not in keys:
+            keys.append(key)
+        # refreshed with the match key so it never expires first
+        self.cache.set(rkey, keys, self.timeout)
+        self.cache.set(key, pk, self.timeout)
+
+def invalidate(sender, instance, using=None, created=False, **kwargs):
+    """ Clear the match keys cached for a saved or deleted row """
+    if created or instance.pk is None:
+        return
+    forget(sender, using, [instance.pk])
+
+def invalidate_batch(sender, instances, created, using=None, **kwargs):
+    """ Clear the match keys cached for rows updated by raw saves,
+        which send batch_saved in place of post_save
+    """
+    forget(sender, using, [instance.pk for instance, new in
+                           zip(instances, created) if not new])
+
+def forget(model, using, pks):
+    """ Clear the match keys cached for the rows, in the
+        CSVIMPORT_LOOKUP_CACHE and any other cache used in this process -
+        for changes that send no signals, eg. queryset deletes
+    """
+    aliases = set(_caches)
+    if getattr(settings, 'CSVIMPORT_LOOKUP_CACHE', ''):
+        aliases.add(settings.CSVIMPORT_LOOKUP_CACHE)
+    if not aliases or not pks:
+        return
+    rkeys = [row_key(model, using, pk) for pk in pks]
+    for alias in aliases:
+        cache = get_lookup_cache(alias)
+        keys = []
+        for rkey, matchkeys in cache.get_many(rkeys).items():
+            keys.extend(matchkeys + [rkey])
+        if keys:
+            cache.delete_many(keys)
+
+def connect(model):
+    """ Clear the model's cached match keys when its rows change,
+        connecting invalidate for just that model so other saves pay
+        nothing
+    """
+    if model in _connected:
+        return
+    _connected.add(model)
+    uid = 'csvimport.lookupcache.%s' % model_label(model)
+    post_save.connect(invalidate, sender=model, dispatch_uid=uid + '.save')
+    post_delete.connect(invalidate, sender=model,
+                        dispatch_uid=uid + '.delete')
+    batch_saved.connect(invalidate_batch, sender=model,
+                        dispatch_uid=uid + '.batch')
+
+def cache_models():
+    return [label.lower() for label in
+            getattr(settings, 'CSVIMPORT_LOOKUP_CACHE_MODELS', ())]
+
+def prepared(sender, **kwargs):
+    if model_label(sender).lower() in cache_models():
+        connect(sender)
+
+def connect_models():
+    """ Connect the CSVIMPORT_LOOKUP_CACHE_MODELS, so their rows clear
+        their entries when changed by processes that do not import, eg.
+        the site itself. Models not loaded yet are connected as their
+        classes are prepared.
+    """
+    labels = cache_models()
+    if not labels:
+        return
+    for label in labels:
+        app_label, name = (label.split('.', 1) + [''])[:2]
+        # seed_cache=False as loading every app here slows startup
+        model = get_model(app_label, name, seed_cache=False)
+        if model:
+            connect(model)
+    class_prepared.connect(prepared,
+                           dispatch_uid='csvimport.lookupcache.prepared')
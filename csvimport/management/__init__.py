@@ -1,10 +1,12 @@
-from django.core.management import _commands, get_commands 
+from django.core import management
 
-if _commands is None:
-    _commands = get_commands()
-
-_commands['csvimport'] = 'djangocsvimport'
-
-        
 
+def register_command():
+    """ Register the csvimport command if django has already built its
+        command cache. Otherwise leave it to get_commands() to discover it
+        on first use, rather than scanning every app's commands at import.
+    """
+    if management._commands is not None:
+        management._commands.setdefault('csvimport', 'csvimport')
 
+register_command()
@@ -1,22 +1,51 @@
 # Run sql files via django#
 # www.heliosfoundation.org
-import os, csv, re
+from __future__ import absolute_import
+import os, re, time, random
 from datetime import datetime
-import codecs
-import chardet
+from hashlib import md5
 
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.core.management.base import LabelCommand, BaseCommand
 from optparse import make_option
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction, DatabaseError, IntegrityError
+from django.db import DEFAULT_DB_ALIAS
 from django.db.models.fields import FieldDoesNotExist
 
+from csvimport.batching import BatchTuner, is_lock_error
+from csvimport.pipeline import Pipeline
+from csvimport.readers import get_reader
+from csvimport.sorting import ExternalSort
+from csvimport.dedupe import Collapser
+from csvimport.indexes import advise, create_index, drop_index
+from csvimport.bulkload import BulkLoad, matched_columns
+from csvimport.rawsave import raw_save
+from csvimport.signals import batch_saved
+from csvimport.lookupcache import LookupCache, get_lookup_cache
+from csvimport.joins import chain_lookups, resolve
+from csvimport.follow import FollowReader, wait_for_change, format_row, parse_row
+from csvimport.rollback import snapshot, before_image, journal_entry, \
+     write_journal, rollback_import
+from csvimport.dryrun import DryRun
+from csvimport.keylocks import KeyLocks
+
 INTEGER = ['BigIntegerField', 'IntegerField', 'AutoField',
            'PositiveIntegerField', 'PositiveSmallIntegerField']
 FLOAT = ['DecimalField', 'FloatField']
 DATE = ['DateTimeField', 'DateField']
 
 NUMERIC = INTEGER + FLOAT
+# Raw saves send batch_saved at least this often when not batching rows
+RAW_CHUNK = 100
+# Rows whose foreign key chains are resolved by each joined query
+JOIN_CHUNK = 500
+# Rows per transaction when following a file, if no batchsize is given
+FOLLOW_BATCH = 100
+# Times a row that hits a lock wait or deadlock is retried, and the
+# seconds to wait before the first retry, doubled for each one after
+LOCK_RETRIES = 3
+LOCK_BACKOFF = 0.1
 # Note if mappings are manually specified they are of the following form ...
 # MAPPINGS = "column1=shared_code,column2=org(Organisation|name),column3=description"
 # statements = re.compile(r";[ \t]*$", re.M)
@@ -73,6 +102,8 @@ class TempModel(object):
         self.m2ms = {}
         self.through = through
         self.instance = None
+        # set once resolved by a joined query, see Command.join_chains
+        self.joined = False
 
     def get_model(self):
         return self.model
@@ -236,8 +267,66 @@ class Command(LabelCommand):
                            help='Please provide the file to import from'),
                make_option('--model', default='iisharing.Item',
                            help='Please provide the model to import to'),
+               make_option('--target', action='append', default=[],
+                           help='Import to more models in the same pass, each as app_label.model_name:mappings'),
+               make_option('--database', default=DEFAULT_DB_ALIAS,
+                           help='Database alias to write to'),
+               make_option('--lookup-database', dest='lookup_database', default='',
+                           help='Database alias, eg. a replica, for matching rows - defaults to --database'),
+               make_option('--consistent', action='store_true', default=False,
+                           help='Match rows created earlier in the import on --database not --lookup-database'),
+               make_option('--join-fks', action='store_true', dest='join_fks',
+                           default=False,
+                           help='Link mappings like fk1.fk2.field to existing fk1 rows with a joined query per chunk of rows'),
+               make_option('--lookup-cache', dest='lookup_cache', default=None,
+                           help='Cache alias to keep foreign key matches in across imports, defaults to the CSVIMPORT_LOOKUP_CACHE setting'),
+               make_option('--lock-keys', action='store_true', dest='lock_keys',
+                           default=None,
+                           help='Lock the match keys of rows to create, so imports into the same models can run at once, defaults to the CSVIMPORT_LOCK_KEYS setting'),
                make_option('--charset', default='',
-                           help='Force the charset conversion used rather than detect it')
+                           help='Force the charset conversion used rather than detect it'),
+               make_option('--reader', default='csv',
+                           help='File reader to use - csv, arrow (needs pyarrow), xlsx (needs openpyxl), jsonl, fixed or auto'),
+               make_option('--sheet', default='',
+                           help='Worksheet to read with the xlsx reader, defaults to the active one'),
+               make_option('--widths', default='',
+                           help='Comma separated column widths for the fixed reader'),
+               make_option('--pipeline', action='store_true', default=False,
+                           help='Read and clean rows in threads alongside the database writes'),
+               make_option('--queuesize', default=100, type='int',
+                           help='Maximum rows queued between pipeline stages'),
+               make_option('--batchsize', default=0, type='int',
+                           help='Rows saved per transaction, default is to save each row as it goes'),
+               make_option('--autobatch', action='store_true', default=False,
+                           help='Tune the rows per transaction from the write latency'),
+               make_option('--maxrate', default=0, type='float',
+                           help='Throttle the import to this many rows per second'),
+               make_option('--collapse', default='',
+                           help='Collapse rows with the same match fields before saving - keep the first, last or merge them'),
+               make_option('--matchindex', action='store_true', default=False,
+                           help='Add temporary indexes over unindexed match fields for the import'),
+               make_option('--bulk-load', action='store_true', dest='bulkload',
+                           default=False,
+                           help='For loads into empty tables, relax fk checks and non-unique indexes then verify them'),
+               make_option('--raw', default=None,
+                           help='Comma separated app_label.model_name list to save without save() or signals, defaults to the CSVIMPORT_RAW_MODELS setting'),
+               make_option('--follow', action='store_true', default=False,
+                           help='Import only the rows appended since the last --follow of the file'),
+               make_option('--poll', default=0, type='float',
+                           help='With --follow keep running, waiting up to this many seconds at a time for new rows'),
+               make_option('--journal', action='store_true', default=False,
+                           help='Journal the rows created and updated so the import can be rolled back'),
+               make_option('--rollback', action='store_true', default=False,
+                           help='Roll back the journalled import whose id is given in place of the file'),
+               make_option('--dry-run', action='store_true', dest='dry_run',
+                           default=False,
+                           help='Report the errors and rows that would be inserted or updated without saving anything'),
+               make_option('--processes', default=0, type='int',
+                           help='Processes to clean rows in for --dry-run, default is one per cpu'),
+               make_option('--sortby', default='',
+                           help='Sort rows before saving by unique, fks or a list of field names'),
+               make_option('--sortbuffer', default=64, type='int',
+                           help='Megabytes of rows to sort in memory before spilling to disk')
                    )
     help = "Imports a CSV file to a model"
 
@@ -253,22 +342,96 @@ class Command(LabelCommand):
         self.defaults = []
         self.app_label = ''
         self.model = ''
+        self.targets = []
         self.file_name = ''
         self.nameindexes = False
         self.deduplicate = True
         self.csvfile = []
         self.charset = ''
+        self.reader = 'csv'
+        self.reader_options = {}
+        self.pipeline = False
+        self.queuesize = 100
+        self.batchsize = 0
+        self.autobatch = False
+        self.maxrate = 0
+        self.batch_history = []
+        self.sortby = ''
+        self.sortbuffer = 64
+        self.collapse = ''
+        self.matchindex = False
+        self.bulkload = False
+        self.bulk = None
+        self.raw_models = []
+        self.raw_pending = []
+        self.database = DEFAULT_DB_ALIAS
+        self.lookup_database = DEFAULT_DB_ALIAS
+        self.consistent = False
+        self.created_keys = set()
+        self.lookup_cache = None
+        self.join_fks = False
+        self.follow = False
+        self.journal = False
+        self.journal_pending = []
+        self.dry_run = False
+        self.processes = 0
+        self.key_locks = None
+        self.lock_retries = LOCK_RETRIES
+        self.lock_backoff = LOCK_BACKOFF
 
     def handle_label(self, label, **options):
         """ Handle the circular reference by passing the nested
             save_csvimport function
         """
+        if options.get('rollback', False):
+            from csvimport.models import CSVImport
+            try:
+                csvimport = CSVImport.objects.get(pk=int(label))
+            except (ValueError, CSVImport.DoesNotExist):
+                return 'There is no import %s to roll back' % label
+            return '\n'.join(rollback_import(csvimport))
         filename = label
         mappings = options.get('mappings', [])
         modelname = options.get('model', 'Item')
+        targets = options.get('target', [])
         charset = options.get('charset','')
+        reader = options.get('reader', 'csv')
+        sheet = options.get('sheet', '')
+        widths = options.get('widths', '')
+        pipeline = options.get('pipeline', False)
+        queuesize = options.get('queuesize', 100)
+        batchsize = options.get('batchsize', 0)
+        autobatch = options.get('autobatch', False)
+        maxrate = options.get('maxrate', 0)
+        sortby = options.get('sortby', '')
+        sortbuffer = options.get('sortbuffer', 64)
+        collapse = options.get('collapse', '')
+        matchindex = options.get('matchindex', False)
+        bulkload = options.get('bulkload', False)
+        raw = options.get('raw', None)
+        database = options.get('database', DEFAULT_DB_ALIAS)
+        lookup_database = options.get('lookup_database', '')
+        consistent = options.get('consistent', False)
+        lookup_cache = options.get('lookup_cache', None)
+        join_fks = options.get('join_fks', False)
+        follow = options.get('follow', False)
+        poll = options.get('poll', 0)
+        journal = options.get('journal', False)
+        dry_run = options.get('dry_run', False)
+        processes = options.get('processes', 0)
+        lock_keys = options.get('lock_keys', None)
         # show_traceback = options.get('traceback', True)
-        self.setup(mappings, modelname, charset, filename)
+        self.setup(mappings, modelname, charset, filename,
+                   reader=reader, sheet=sheet, widths=widths,
+                   pipeline=pipeline, queuesize=queuesize,
+                   batchsize=batchsize, autobatch=autobatch, maxrate=maxrate,
+                   targets=targets, sortby=sortby, sortbuffer=sortbuffer,
+                   collapse=collapse, matchindex=matchindex,
+                   bulkload=bulkload, raw=raw, database=database,
+                   lookup_database=lookup_database, consistent=consistent,
+                   lookup_cache=lookup_cache, join_fks=join_fks,
+                   follow=follow, journal=journal, dry_run=dry_run,
+                   processes=processes, lock_keys=lock_keys)
         if not hasattr(self.model, '_meta'):
             msg = 'Sorry your model could not be found please check app_label.modelname'
             try:
@@ -276,6 +439,13 @@ class Command(LabelCommand):
             except:
                 self.loglist.append(msg)
             return
+        if self.follow:
+            self.follow_file(poll)
+            return
+        if self.dry_run:
+            return '\n'.join(self.run())
+        if self.journal:
+            return self.journal_run()
         errors = self.run()
         if self.props:
             save_csvimport(self.props, self)
@@ -283,8 +453,38 @@ class Command(LabelCommand):
         return
 
     def setup(self, mappings, modelname, charset, csvfile='', defaults='',
-              uploaded=None, nameindexes=False, deduplicate=True):
-        """ Setup up the attributes for running the import """
+              uploaded=None, nameindexes=False, deduplicate=True,
+              pipeline=False, queuesize=100, batchsize=0, autobatch=False,
+              maxrate=0, reader='csv', targets=(), sortby='', sortbuffer=64,
+              collapse='', matchindex=False, bulkload=False, raw=None,
+              database='', lookup_database='', consistent=False,
+              lookup_cache=None, join_fks=False, follow=False,
+              journal=False, dry_run=False, processes=0, sheet='',
+              widths='', lock_keys=None):
+        """ Setup up the attributes for running the import
+            targets is a list of 'app_label.model_name:mappings' strings
+            to import each row to more models as well as the model
+            raw is a list, or comma separated string, of app_label.model_name
+            to save without calling save() or sending signals, which
+            defaults to the CSVIMPORT_RAW_MODELS setting
+            database is the alias written to, and lookup_database the one
+            rows are matched on, which with consistent is only used for rows
+            not created earlier in the import - eg. for a lagging replica
+            lookup_cache is the cache alias foreign key matches are kept in
+            between imports, which defaults to the CSVIMPORT_LOOKUP_CACHE
+            setting
+            join_fks links chains of foreign keys to existing rows with a
+            joined query, see join_chains
+            follow leaves the file to be read by follow_file
+            journal records the rows created and updated, with a before
+            image of the updated fields, so the import can be rolled back
+            dry_run checks the rows without saving them, cleaning them in
+            a pool of processes (one per cpu if 0), see csvimport.dryrun
+            sheet and widths are passed to the xlsx and fixed width readers
+            lock_keys locks the match keys of rows to create until they
+            are committed, so imports can run at once into the same
+            models, which defaults to the CSVIMPORT_LOCK_KEYS setting
+        """
         self.defaults = self.__mappings(defaults)
         if modelname.find('.') > -1:
             app_label, model = modelname.split('.')
@@ -293,14 +493,89 @@ class Command(LabelCommand):
         self.model = models.get_model(app_label, model)
         if mappings:
             self.mappings = self.__mappings(mappings)
+        self.targets = self.setup_targets(targets)
         self.nameindexes = bool(nameindexes)
         self.file_name = csvfile
         self.deduplicate = deduplicate
+        self.reader = reader
+        self.reader_options = {}
+        if sheet:
+            self.reader_options['sheet'] = sheet
+        if widths:
+            self.reader_options['widths'] = widths
+        self.pipeline = bool(pipeline)
+        self.queuesize = queuesize
+        self.batchsize = batchsize
+        self.follow = bool(follow)
+        if self.follow and not batchsize:
+            self.batchsize = FOLLOW_BATCH
+        self.autobatch = bool(autobatch)
+        self.maxrate = maxrate
+        self.sortby = sortby
+        self.sortbuffer = sortbuffer
+        self.collapse = collapse
+        self.matchindex = bool(matchindex)
+        self.bulkload = bool(bulkload)
+        self.database = database or DEFAULT_DB_ALIAS
+        self.lookup_database = lookup_database or self.database
+        self.consistent = bool(consistent)
+        self.created_keys = set()
+        self.join_fks = bool(join_fks)
+        self.journal = bool(journal)
+        self.journal_pending = []
+        self.dry_run = bool(dry_run)
+        self.processes = processes
+        self.lookup_cache = None
+        cache = get_lookup_cache(lookup_cache)
+        if cache is not None:
+            self.lookup_cache = LookupCache(cache, self.database)
+        if lock_keys is None:
+            lock_keys = getattr(settings, 'CSVIMPORT_LOCK_KEYS', False)
+        self.key_locks = None
+        if lock_keys:
+            self.key_locks = KeyLocks(self.database)
+        if raw is None:
+            raw = getattr(settings, 'CSVIMPORT_RAW_MODELS', [])
+        if isinstance(raw, basestring):
+            raw = [name.strip() for name in raw.split(',') if name.strip()]
+        self.raw_models = []
+        for name in raw:
+            raw_model = models.get_model(*(name.split('.', 1) + [''])[:2])
+            if raw_model:
+                self.raw_models.append(raw_model)
+            else:
+                self.loglist.append('Raw save model %s could not be found' % name)
         if uploaded:
             self.csvfile = self.__csvfile(uploaded.path)
+        elif self.follow:
+            if not os.path.isfile(csvfile):
+                raise Exception('File %s not found' % csvfile)
         else:
             self.check_filesystem(csvfile)
 
+    def setup_targets(self, targets):
+        """ Parse the targets into (model, mappings) ordered so that
+            models come after any of the other targets they have fks to.
+            The model, if found and not a target itself, is the first
+            target with the mappings, or the header row's if there are none.
+        """
+        parsed = []
+        for target in targets:
+            modelname, mappings = (target.split(':', 1) + [''])[:2]
+            app_label, model = (modelname.split('.', 1) + [''])[:2]
+            model = models.get_model(app_label, model)
+            if not model:
+                self.loglist.append('Target %s could not be found please '
+                                    'check app_label.modelname' % modelname)
+                continue
+            parsed.append((model, self.__mappings(mappings)))
+        if parsed and not hasattr(self.model, '_meta'):
+            self.model = parsed[0][0]
+        elif parsed and self.model not in [model for model, mappings
+                                           in parsed]:
+            parsed.insert(0, (self.model, self.mappings))
+        return order_targets(parsed)
+
     def check_filesystem(self, csvfile):
         """ Check for files on the file system """
         if os.path.exists(csvfile):
@@ -320,9 +595,12 @@ class Command(LabelCommand):
             raise Exception('File %s not found' % csvfile)
 
     def run(self, logid=0):
+        rows = iter(self.csvfile)
+        indexes = []
         if self.nameindexes:
-            indexes = self.csvfile.pop(0)
-        counter = 0
+            indexes = rows.next()
+        # The first row is the header row, so never imported
+        header = next(rows, [])
         if logid:
             csvimportid = logid
         else:
@@ -332,10 +610,11 @@ class Command(LabelCommand):
         for field in self.model._meta.fields:
             fieldmap[field.name] = field
 
-        if self.mappings:
+        target_mappings = [mappings for model, mappings in self.targets]
+        if self.mappings or (target_mappings and all(target_mappings)):
             self.loglist.append('Using manually entered mapping list')
         else:
-            for i, heading in enumerate(self.csvfile[0]):
+            for i, heading in enumerate(header):
                 key = heading.lower()
                 if not key:
                     continue
@@ -345,87 +624,649 @@ class Command(LabelCommand):
             if mapping:
                 self.loglist.append('Using mapping from first row of CSV file')
                 self.mappings = self.__mappings(mappingstr)
-        if not self.mappings:
+        if not (self.mappings or self.targets):
             self.loglist.append('''No fields in the CSV file match %s.%s\n
                                    - you must add a header field name row
                                    to the CSV file or supply a mapping list''' %
                                 (self.model._meta.app_label, self.model.__name__))
             return self.loglist
 
-        for row_ind, row in enumerate(self.csvfile[1:]):
-            counter += 1
-            # create the top level instance
-            instance_tree = TempModel(self.model)
+        if self.targets:
+            self.loglist.append('Importing to %s' % ', '.join(
+                [model.__name__ for model, mappings in self.targets]))
+        items = enumerate(rows)
+        collapser = None
+        if self.collapse:
+            collapser = self.collapser(indexes)
+            if collapser:
+                items = collapser.collapse(items)
+        if self.sortby:
+            items = self.sort_rows(items, indexes)
+        if self.dry_run:
+            dryrun = DryRun(self, indexes, processes=self.processes,
+                            using=self.lookup_database)
+            self.loglist.extend(dryrun.check(items))
+            return self.loglist
+        temp_indexes = self.check_indexes()
+        if self.journal and not csvimportid:
+            self.loglist.append('Rows are not journalled as there is no'
+                                ' CSVImport record for the import')
+            self.journal = False
+        if self.bulkload:
+            targets = [(model, mappings or self.mappings)
+                       for model, mappings in self.targets] or \
+                      [(self.model, self.mappings)]
+            # rows are still matched, so their match indexes are kept
+            self.bulk = BulkLoad([model for model, mappings in targets],
+                                 using=self.database,
+                                 keep=matched_columns(targets))
+            self.loglist.extend(self.bulk.start())
+        try:
+            cleaned = self.clean_rows(items, indexes)
+            if self.join_fks:
+                cleaned = self.join_chains(cleaned)
+            self.write(cleaned, csvimportid)
+        finally:
+            for model, name in temp_indexes:
+                drop_index(model, name, using=self.database)
+                self.loglist.append('Dropped temporary index %s' % name)
+            if self.bulk:
+                self.loglist.extend(self.bulk.finish())
+                self.bulk = None
+        if collapser:
+            self.loglist.append('Collapsed %s duplicate rows of %s match keys'
+                                ' in the file (%s)' % (collapser.duplicates,
+                                                       collapser.keys,
+                                                       self.collapse))
+        if self.lookup_cache and (self.lookup_cache.hits or
+                                  self.lookup_cache.misses):
+            self.loglist.append('Lookup cache resolved %s of %s foreign keys'
+                                % (self.lookup_cache.hits,
+                                   self.lookup_cache.hits +
+                                   self.lookup_cache.misses))
+        if self.key_locks and self.key_locks.acquired:
+            self.loglist.append('Locked %s match keys of rows to create'
+                                % self.key_locks.acquired)
+        if self.loglist:
+            self.props = { 'file_name':self.file_name,
+                           'import_user':'cron',
+                           'upload_method':'cronjob',
+                           'error_log':'\n'.join(self.loglist),
+                           'import_date':datetime.now()}
+            return self.loglist
 
-            for (field_names, column) in self.mappings:
+    def journal_run(self):
+        """ Run the import with a CSVImport record made first, so the
+            journal can refer to it, returning how to roll it back
+        """
+        from csvimport.models import CSVImport
+        csvimport = CSVImport(file_name=self.file_name,
+                              upload_file=self.file_name,
+                              upload_method='cronjob', import_user='cron',
+                              database=self.database,
+                              model_name='%s.%s' % (self.model._meta.app_label,
+                                                    self.model.__name__))
+        csvimport.save()
+        self.run(logid=csvimport.id)
+        csvimport.error_log = '\n'.join(self.loglist)
+        csvimport.save()
+        return ('Journalled as import %s, roll it back with'
+                ' --rollback %s' % (csvimport.id, csvimport.id))
+
+    def follow_file(self, poll=0):
+        """ Import the complete rows appended to the file since the last
+            follow, whose byte offset and header are kept on a CSVImport
+            record with the log of the latest rows.
+            With poll keep running, waiting up to poll seconds at a time
+            for the file to grow.
+        """
+        from csvimport.models import CSVImport
+        records = list(CSVImport.objects.filter(
+            file_name=self.file_name, upload_method='follow').order_by('-id')[:1])
+        if records:
+            record = records[0]
+        else:
+            record = CSVImport(file_name=self.file_name,
+                               upload_file=self.file_name,
+                               upload_method='follow', import_user='cron',
+                               model_name='%s.%s' % (
+                                   self.model._meta.app_label,
+                                   self.model.__name__))
+            record.save()
+        while True:
+            seen = self.follow_once(record)
+            if not poll:
+                return
+            # the size not the offset, which a partial last row is past
+            wait_for_change(self.file_name, seen, poll)
 
-                if self.nameindexes:
-                    column = indexes.index(column)
-                else:
-                    column = int(column)-1
+    def follow_once(self, record):
+        """ Import the rows appended since the record's offset, a chunk
+            of the file at a time, saving the record after each chunk.
+            Returns the file size when it was last read.
+        """
+        charset = self.charset or record.encoding or \
+                  get_reader(self.file_name).charset
+        reader = FollowReader(self.file_name, record.follow_offset, charset)
+        truncated = reader.truncated()
+        if truncated:
+            self.loglist.append('%s is shorter than when last read, so it is'
+                                ' imported from the start' % self.file_name)
+            reader.offset = 0
+            record.follow_header = ''
+        while True:
+            start = reader.offset
+            rows = reader.read()
+            if reader.offset == start and not truncated:
+                # nothing new, so the record is left as it is
+                return reader.seen
+            truncated = False
+            if rows and not record.follow_header:
+                record.follow_header = format_row(rows.pop(0))
+            if rows:
+                self.csvfile = [parse_row(record.follow_header)] + rows
+                self.run(logid=record.id)
+                self.loglist.append('Imported %s rows from byte %s of the'
+                                    ' file' % (len(rows), start))
+            if self.loglist:
+                record.error_log = '\n'.join(self.loglist)
+                self.loglist = []
+            record.follow_offset = reader.offset
+            record.encoding = charset
+            record.import_date = datetime.now()
+            record.save()
+
+    def check_indexes(self):
+        """ Log advice for models that would be looked up on unindexed
+            columns, and if matchindex is set add temporary indexes
+            over them, returning the (model, index name) added
+        """
+        temp_indexes = []
+        seen = []
+        for model, mappings in self.targets or [(self.model, self.mappings)]:
+            for lookup_model, fields, msg in advise(model,
+                                                    mappings or self.mappings,
+                                                    using=self.database):
+                if (lookup_model, fields) in seen:
+                    continue
+                seen.append((lookup_model, fields))
+                if not self.matchindex:
+                    self.loglist.append(msg)
+                    continue
+                name = create_index(lookup_model, fields, using=self.database)
+                temp_indexes.append((lookup_model, name))
+                self.loglist.append('Added temporary index %s on %s (%s)' % (
+                    name, lookup_model._meta.db_table,
+                    ', '.join([field.column for field in fields])))
+        return temp_indexes
+
+    def collapser(self, indexes):
+        """ Collapser for rows whose match columns are the same, so
+            duplicates in the file cost one lookup and save, not one each
+        """
+        columns = []
+        for model, mappings in self.targets or [(self.model, self.mappings)]:
+            for column in self.match_columns(model, mappings or self.mappings,
+                                             indexes):
+                if column not in columns:
+                    columns.append(column)
+        if not columns:
+            self.loglist.append('No match fields are mapped so duplicate'
+                                ' rows are not collapsed')
+            return None
+
+        def key(item):
+            row = item[1]
+            return [column < len(row) and row[column] or u''
+                    for column in columns]
+
+        return Collapser(key, rule=self.collapse,
+                         buffersize=self.sortbuffer * 1024 * 1024)
+
+    def match_columns(self, model, mappings, indexes):
+        """ Columns fetch_for_values would match the model's rows on -
+            those mapped to unique fields or failing that required fields
+        """
+        unique = []
+        required = []
+        for field_names, column in mappings:
+            try:
+                field = model._meta.get_field(field_names[0])
+            except FieldDoesNotExist:
+                continue
+            # m2ms don't identify their parent
+            if field.get_internal_type() == 'ManyToManyField':
+                continue
+            column = self.column_index(column, indexes)
+            if field.unique:
+                unique.append(column)
+            elif not field.blank:
+                required.append(column)
+        return unique or required
+
+    def sort_rows(self, items, indexes):
+        """ Sort the (row_ind, row) items by the sortby columns, so rows
+            are written in key order rather than scattered across the
+            table's indexes. Uses an external merge sort so files bigger
+            than the sortbuffer are spilled to disk rather than held in memory.
+        """
+        columns = self.sort_columns(indexes)
+        if not columns:
+            self.loglist.append('No mapped columns match sortby %s so rows'
+                                ' are saved in file order' % self.sortby)
+            return items
+        cleaner = TempModel(None)
+
+        def key(item):
+            # cells cleaned for their field, so numbers sort as numbers,
+            # with those that do not clean after them as strings
+            row = item[1]
+            values = []
+            for column, field_type in columns:
+                value = column < len(row) and row[column] or u''
+                try:
+                    values.append((0, cleaner.clean(value, field_type)))
+                except InvalidValue:
+                    values.append((1, value))
+            return values
+
+        self.loglist.append('Sorting rows by column %s before saving' %
+                            ', '.join([str(column + 1) for column, field_type
+                                       in columns]))
+        sorter = ExternalSort(key, buffersize=self.sortbuffer * 1024 * 1024)
+        return sorter.sort(items)
+
+    def sort_columns(self, indexes):
+        """ Column indexes for sortby - the model's unique fields,
+            its foreign keys or a comma separated list of field names -
+            with the type of the field each column's value is set on.
+            With targets the first one to be saved is used.
+        """
+        model, mappings = (self.targets or [(self.model, self.mappings)])[0]
+        mappings = mappings or self.mappings
+        fields = model._meta.fields
+        if self.sortby == 'unique':
+            names = [field.name for field in fields if field.unique]
+        elif self.sortby == 'fks':
+            names = [field.name for field in fields if field.rel]
+        else:
+            names = [name.strip() for name in self.sortby.split(',')]
+        columns = []
+        for name in names:
+            for field_names, column in mappings:
+                if field_names[0] == name:
+                    columns.append((self.column_index(column, indexes),
+                                    self.value_type(model, field_names)))
+        return columns
+
+    def value_type(self, model, field_names):
+        """ Internal type of the field a mapping sets the value of,
+            following foreign keys, or None if there is no such field
+        """
+        field = None
+        for name in field_names:
+            if name.isdigit():
+                # m2m index
+                continue
+            if field is not None:
+                if not field.rel:
+                    return None
+                model = field.rel.to
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+        return field and field.get_internal_type()
 
-                value = row[column]
-                if value == '':
+    def column_index(self, column, indexes):
+        """ Index of a mapping's column in the row """
+        if self.nameindexes:
+            return indexes.index(column)
+        return int(column)-1
+
+    def clean_rows(self, items, indexes):
+        """ Map and clean the (row_ind, row) items, yielding each row's
+            index, trees of TempModels - one per target model in the order
+            they are saved - and any messages to log before it is saved.
+            In pipeline mode reading and cleaning run in their own threads
+            while the calling thread does the database writes, so parsing
+            the next rows overlaps with saving the current one.
+            Database work stays in the calling thread so it uses the same
+            connection and transaction as the sequential run.
+        """
+        targets = self.targets or [(self.model, self.mappings)]
+
+        def clean(item):
+            row_ind, row = item
+            messages = []
+            instance_trees = [self.row_tree(row_ind, row, indexes, messages,
+                                            model, mappings or self.mappings)
+                              for model, mappings in targets]
+            return row_ind, instance_trees, messages
+
+        if self.pipeline:
+            return Pipeline(items, [clean], maxsize=self.queuesize)
+        return (clean(item) for item in items)
+
+    def join_chains(self, cleaned):
+        """ Resolve read-only foreign key chains in the cleaned rows,
+            JOIN_CHUNK rows at a time. A mapping like column3=fk1.fk2.field
+            links to the existing fk1 whose fk2 has the field value, with
+            one joined query for the chunk, rather than looking up or
+            creating each level for every row.
+            This runs in the calling thread as the writes do.
+        """
+        chunk = []
+        for item in cleaned:
+            chunk.append(item)
+            if len(chunk) >= JOIN_CHUNK:
+                self.join_chunk(chunk)
+                for item in chunk:
+                    yield item
+                chunk = []
+        if chunk:
+            self.join_chunk(chunk)
+            for item in chunk:
+                yield item
+
+    def join_chunk(self, chunk):
+        """ Set the instances of the chains' first leaves, adding a
+            message to the row where there is no single matching row
+        """
+        using = self.lookup_database
+        if self.consistent:
+            using = self.database
+        chains = {}
+        order = []
+        for row_ind, instance_trees, messages in chunk:
+            for instance_tree in instance_trees:
+                for field, fk in instance_tree.get_fks():
+                    chain = chain_lookups(fk)
+                    if not chain:
+                        continue
+                    lookups, key = chain
+                    if (fk.get_model(), lookups) not in chains:
+                        chains[(fk.get_model(), lookups)] = []
+                        order.append((fk.get_model(), lookups))
+                    chains[(fk.get_model(), lookups)].append(
+                        (row_ind, fk, key, messages))
+        for model, lookups in order:
+            leaves = chains[(model, lookups)]
+            found = resolve(model, lookups, [key for row_ind, fk, key,
+                                             messages in leaves], using=using)
+            for row_ind, fk, key, messages in leaves:
+                fk.joined = True
+                pks = found.get(key, [])
+                if len(pks) == 1:
+                    instance = model()
+                    instance.pk = pks[0]
+                    instance._state.adding = False
+                    instance._state.db = self.database
+                    fk.set_instance(instance)
                     continue
+                messages.append('Row %s: %s %s rows match %s' % (
+                    row_ind + 1, len(pks) and 'multiple' or 'no',
+                    model.__name__, ', '.join(['%s=%s' % (lookup, value)
+                                               for lookup, value in
+                                               zip(lookups, key)])))
+
+    def write(self, cleaned, csvimportid):
+        """ Save the cleaned rows, one at a time or in batched transactions
+            whose size is tuned by the write latency if autobatch is set.
+            Bulk loads are always batched, so deferred constraints last
+            for more than one row, and so are imports with key locks, so
+            a deadlock on them rolls back and retries the rows.
+        """
+        if not (self.batchsize or self.autobatch or self.maxrate or
+                self.bulkload or self.key_locks):
+            for item in cleaned:
+                row_ind, instance_trees, messages = item
+                self.loglist.extend(messages)
+                mark = len(self.raw_pending)
+                try:
+                    for instance_tree in instance_trees:
+                        self.save_tree(self.row_label(row_ind, instance_tree),
+                                       instance_tree, csvimportid)
+                    self.flush_journal(csvimportid)
+                except DatabaseError, err:
+                    if not is_lock_error(err):
+                        raise
+                    transaction.rollback_unless_managed(using=self.database)
+                    del self.raw_pending[mark:]
+                    self.journal_pending = []
+                    self.loglist.append('Row %s rolled back on lock wait (%s)'
+                                        ' so retrying it' % (row_ind + 1, err))
+                    self.retry_row(item, csvimportid)
+                if len(self.raw_pending) >= RAW_CHUNK:
+                    self.send_batch_saved()
+            self.send_batch_saved()
+            return
 
-                if self.debug:
-                    self.loglist.append('%s.%s = "%s"' % (self.model.__name__,
-                                                          field, value))
+        size = self.batchsize or 100
+        if self.key_locks and not self.batchsize:
+            # the locks are held until the transaction ends
+            size = 1
+        tuner = BatchTuner(size=size,
+                           autotune=self.autobatch,
+                           maxrate=self.maxrate)
+        tuner.start()
+        batch = []
+        for item in cleaned:
+            batch.append(item)
+            if len(batch) >= tuner.size:
+                self.write_batch(batch, tuner, csvimportid)
+                batch = []
+        if batch:
+            self.write_batch(batch, tuner, csvimportid)
+        self.batch_history = tuner.history
+
+    def write_batch(self, batch, tuner, csvimportid):
+        """ Save a batch of rows in one transaction, with a savepoint
+            per row so one failed row does not lose the rest.
+            If the batch hits a lock wait it is rolled back, the tuner
+            backs off and the rows are retried one per transaction.
+        """
+        for row_ind, instance_trees, messages in batch:
+            self.loglist.extend(messages)
+        start = time.time()
+        try:
+            self.save_batch(batch, csvimportid)
+        except DatabaseError, err:
+            # the rows are saved again below
+            self.raw_pending = []
+            self.journal_pending = []
+            if is_lock_error(err):
+                tuner.locked()
+                reason = 'on lock wait'
+            elif isinstance(err, IntegrityError):
+                # deferred constraints fail on commit
+                reason = 'on commit'
+            else:
+                raise
+            self.loglist.append('Rows %s to %s rolled back %s (%s)'
+                                ' so retrying each row' %
+                                (batch[0][0] + 1, batch[-1][0] + 1, reason, err))
+            for item in batch:
+                self.retry_row(item, csvimportid)
+        else:
+            tuner.record(len(batch), time.time() - start)
+        self.send_batch_saved()
+        tuner.throttle(len(batch))
+
+    def retry_row(self, item, csvimportid):
+        """ Save a row in its own transaction, trying again up to
+            lock_retries times after a lock wait or deadlock - pausing
+            for lock_backoff seconds, doubled for each retry, with jitter
+            so imports that deadlocked together do not retry in step.
+            A row that still fails is logged as not saved.
+        """
+        delay = self.lock_backoff
+        for attempt in range(self.lock_retries + 1):
+            mark = len(self.raw_pending)
+            try:
+                self.save_batch([item], csvimportid)
+                return True
+            except DatabaseError, err:
+                del self.raw_pending[mark:]
+                self.journal_pending = []
+                if is_lock_error(err) and attempt < self.lock_retries:
+                    time.sleep(delay * (1 + random.random()))
+                    delay *= 2
+                    continue
+                if not (is_lock_error(err) or
+                        isinstance(err, IntegrityError)):
+                    raise
+                self.loglist.append('Instance %s not saved (%s)' % (
+                                    item[0] + 1, err))
+                return False
+
+    def save_batch(self, batch, csvimportid):
+        """ Save rows in a single transaction, writing the batch for
+            each target model in turn so parent tables are flushed first
+        """
+        with transaction.commit_on_success(using=self.database):
+            if self.bulk:
+                self.bulk.defer()
+            for position in range(len(batch[0][1])):
+                for row_ind, instance_trees, messages in batch:
+                    instance_tree = instance_trees[position]
+                    sid = transaction.savepoint(using=self.database)
+                    mark = len(self.raw_pending)
+                    journal_mark = len(self.journal_pending)
+                    if self.save_tree(self.row_label(row_ind, instance_tree),
+                                      instance_tree, csvimportid):
+                        transaction.savepoint_commit(sid, using=self.database)
+                    else:
+                        transaction.savepoint_rollback(sid,
+                                                       using=self.database)
+                        del self.raw_pending[mark:]
+                        del self.journal_pending[journal_mark:]
+            # journalled in the same transaction as the rows
+            self.flush_journal(csvimportid)
+
+    def row_label(self, row_ind, instance_tree):
+        """ Row number for the log, with the model if there are targets """
+        if self.targets:
+            return '%s (%s)' % (row_ind + 1, instance_tree.get_model().__name__)
+        return row_ind + 1
+
+    def row_tree(self, row_ind, row, indexes, loglist, model=None,
+                 mappings=None, errors=None):
+        """ Map a row's values on to a tree of TempModels
+            appending any mapping errors to loglist, and if given to
+            errors as (column, message)
+        """
+        model = model or self.model
+        # create the top level instance
+        instance_tree = TempModel(model)
+
+        for (field_names, column) in mappings or self.mappings:
+
+            column = self.column_index(column, indexes)
+
+            value = row[column]
+            if value == '':
+                continue
 
-                current_leaf = instance_tree
+            if self.debug:
+                loglist.append('%s.%s = "%s"' % (model.__name__,
+                                                 field, value))
 
-                field_names = list(field_names)
-                while field_names:
-                    # take the leftmost fieldname and try and resolve
-                    # it against the current model
-                    field_name = field_names.pop(0)
+            current_leaf = instance_tree
+
+            field_names = list(field_names)
+            while field_names:
+                # take the leftmost fieldname and try and resolve
+                # it against the current model
+                field_name = field_names.pop(0)
+                try:
                     try:
+                        ind_string = field_names.pop(0)
                         try:
-                            ind_string = field_names.pop(0)
-                            try:
-                                ind = int(ind_string)
-                            except ValueError:
-                                # not an ind; put it back
-                                # this should be an fk
-                                field_names = [ind_string] + field_names
-                                current_leaf = current_leaf.add_fk(field_name)
-                                continue
-                            current_leaf = current_leaf.add_m2m(field_name, ind)
+                            ind = int(ind_string)
+                        except ValueError:
+                            # not an ind; put it back
+                            # this should be an fk
+                            field_names = [ind_string] + field_names
+                            current_leaf = current_leaf.add_fk(field_name)
                             continue
+                        current_leaf = current_leaf.add_m2m(field_name, ind)
+                        continue
 
-                        except IndexError:
-                            # Last field name, this is just a regular
-                            # value field
-                            try:
-                                current_leaf = current_leaf.add_value(field_name, value)
-                            except InvalidValue, e:
-                                msg = "Could not prepare value '%s' in cell [%s, %s]" % \
-                                    (value, row_ind, column)
-                                self.loglist.append(msg)
-                    except InvalidFieldType, e:
-                        msg = "mapping string mapped field %s to invalid field type (%s)" % \
-                            (field_name, e)
-                        self.loglist.append(msg)
-
-                    except NoSuchField, e:
-                        msg = "%s" % (e)
-                        self.loglist.append(msg)
+                    except IndexError:
+                        # Last field name, this is just a regular
+                        # value field
+                        try:
+                            current_leaf = current_leaf.add_value(field_name, value)
+                        except InvalidValue, e:
+                            msg = "Could not prepare value '%s' in cell [%s, %s]" % \
+                                (value, row_ind, column)
+                            loglist.append(msg)
+                            if errors is not None:
+                                errors.append((column, msg))
+                except InvalidFieldType, e:
+                    msg = "mapping string mapped field %s to invalid field type (%s)" % \
+                        (field_name, e)
+                    loglist.append(msg)
+                    if errors is not None:
+                        errors.append((column, msg))
+
+                except NoSuchField, e:
+                    msg = "%s" % (e)
+                    loglist.append(msg)
+                    if errors is not None:
+                        errors.append((column, msg))
+        return instance_tree
+
+    def save_tree(self, counter, instance_tree, csvimportid):
+        """ Save a row's tree of instances, logging if it fails """
+        try:
+            instance = self.tree_save(instance_tree)
+
+            # TODO: this is a hangover from the original code; check if necessary
+            instance.csvimport_id = csvimportid
+            # a raw save only writes fields so has nothing more to save
+            if instance.__class__ not in self.raw_models:
+                instance.save(using=self.database)
+        except TreeSaveException, err:
+            self.loglist.append('Instance %s not saved (%s)' % (counter, err))
+            return False
+        return True
+
+    def save_instance(self, instance):
+        """ Save the instance, with a raw save if its model is in
+            raw_models, noting it for the next batch_saved signal
+        """
+        if instance.__class__ in self.raw_models:
+            created = raw_save(instance, using=self.database)
+            self.raw_pending.append((instance, created))
+        else:
+            instance.save(using=self.database)
 
-            try:
-                instance = self.tree_save(instance_tree)
+    def flush_journal(self, csvimportid):
+        """ Write the journal entries for the rows saved since the last """
+        if self.journal_pending:
+            write_journal(csvimportid, self.journal_pending, using=self.database)
+            self.journal_pending = []
 
-                # TODO: this is a hangover from the original code; check if necessary
-                instance.csvimport_id = csvimportid
-                instance.save()
-            except TreeSaveException, err:
-                self.loglist.append('Instance %s not saved (%s)' % (counter, err))
-        if self.loglist:
-            self.props = { 'file_name':self.file_name,
-                           'import_user':'cron',
-                           'upload_method':'cronjob',
-                           'error_log':'\n'.join(self.loglist),
-                           'import_date':datetime.now()}
-            return self.loglist
+    def send_batch_saved(self):
+        """ Send one batch_saved signal per model for the raw saves
+            since the last one, in place of their per row signals
+        """
+        by_model = {}
+        order = []
+        for instance, created in self.raw_pending:
+            model = instance.__class__
+            if model not in by_model:
+                by_model[model] = ([], [])
+                order.append(model)
+            by_model[model][0].append(instance)
+            by_model[model][1].append(created)
+        self.raw_pending = []
+        for model in order:
+            instances, created = by_model[model]
+            batch_saved.send(sender=model, instances=instances,
+                             created=created, using=instances[0]._state.db)
 
     def fetch_for_values(self, leaf):
 
@@ -436,14 +1277,8 @@ class Command(LabelCommand):
         # add a new optional field and it
         # wont match)
 
-        matchdict = {}
         instance = None
-        matchdict = leaf.get_unique_fields_dict()
-
-        if not len(matchdict):
-            # no unique values specified
-            # add required values
-            matchdict = leaf.get_required_fields_dict()
+        matchdict = self.match_dict(leaf)
 
         if not len(matchdict):
             # No values specified. No point in searching
@@ -451,8 +1286,25 @@ class Command(LabelCommand):
 
         # Note: skip M2M fields as they don't really 'identify' their parent
 
+        lookup = self.lookup_database
+        if lookup != self.database and self.consistent and \
+           self.match_key(leaf, matchdict) in self.created_keys:
+            # created in this import so may not be on the lookup db yet
+            lookup = self.database
         try:
-            instance = leaf.get_model().objects.get(**matchdict)
+            try:
+                instance = leaf.get_model().objects.using(lookup).get(
+                    **matchdict)
+            except ObjectDoesNotExist:
+                if not self.key_locks:
+                    raise
+                # look again once locked, as another import may have
+                # created the row while this one waited for the lock
+                self.key_locks.acquire(self.match_key(leaf, matchdict))
+                instance = leaf.get_model().objects.using(
+                    self.database).get(**matchdict)
+            # the row is written back to the database not the lookup one
+            instance._state.db = self.database
         except MultipleObjectsReturned:
             # The leaf values matched multiple instances.
             # No clear path ahead here so bail
@@ -464,17 +1316,79 @@ class Command(LabelCommand):
 
         return instance
 
-    def tree_save(self, leaf):
+    def match_dict(self, leaf):
+        """ Lookups to match the leaf's instance on - unique fields,
+            or failing that required fields
+        """
+        matchdict = leaf.get_unique_fields_dict()
+
+        if not len(matchdict):
+            # no unique values specified
+            # add required values
+            matchdict = leaf.get_required_fields_dict()
+        return matchdict
+
+    def match_key(self, leaf, matchdict):
+        """ Digest of the model and its match values """
+        model = leaf.get_model()
+        return md5(repr((model._meta.app_label, model.__name__,
+                         sorted(matchdict.items())))).digest()
+
+    def cache_match(self, leaf):
+        """ Match lookups if the lookup cache can resolve the leaf -
+            when it only sets the fields it is matched on, so an
+            existing row would be saved unchanged
+        """
+        if self.lookup_cache is None or leaf.get_m2ms():
+            return {}
+        matchdict = self.match_dict(leaf)
+        matched = set([lookup.split('__')[0] for lookup in matchdict])
+        for field, value in leaf.get_values() + leaf.get_fks():
+            if field.name not in matched:
+                return {}
+        return matchdict
+
+    def cached_instance(self, leaf, matchdict):
+        """ Stand in for the cached row, with its primary key and
+            match values, or None if it is not cached
+        """
+        model = leaf.get_model()
+        pk = self.lookup_cache.get(model, matchdict)
+        if pk is None:
+            return None
+        instance = model()
+        for field, value in leaf.get_values():
+            instance.__setattr__(field.name, value)
+        for field, fk in leaf.get_fks():
+            instance.__setattr__(field.name, fk.get_instance())
+        instance.pk = pk
+        instance._state.adding = False
+        instance._state.db = self.database
+        return instance
+
+    def tree_save(self, leaf, is_fk=False):
+
+        if leaf.joined:
+            # linked to an existing row by join_chains
+            return leaf.get_instance()
 
         # save fks first as these may be null=False
         for field, fk in leaf.get_fks():
             try:
-                self.tree_save(fk)
+                self.tree_save(fk, is_fk=True)
             except TreeSaveException, e:
                 self.loglist.append('Couldnt create fk %s for %s: %s.'
                         % (field.name, fk.get_model(), e))
                 continue
 
+        # foreign keys already resolved by an earlier import need no query
+        cache_match = is_fk and self.cache_match(leaf)
+        if cache_match:
+            instance = self.cached_instance(leaf, cache_match)
+            if instance:
+                leaf.set_instance(instance)
+                return instance
+
         try:
             instance = self.fetch_for_values(leaf)
         except NonUniqueLeafValues:
@@ -484,6 +1398,12 @@ class Command(LabelCommand):
 
             raise TreeSaveException(error)
 
+        created = not instance
+        if self.journal and not created:
+            before = snapshot(instance, [field for field, value in
+                                         leaf.get_values()] +
+                                        [field for field, fk in leaf.get_fks()
+                                         if fk.get_instance()])
         if not instance:
             try:
                 instance = leaf.get_model()()
@@ -513,11 +1433,28 @@ class Command(LabelCommand):
 
         # Need to save the main instance before setting m2ms
         try:
-            instance.save()
+            self.save_instance(instance)
+        except DatabaseError, err:
+            if is_lock_error(err):
+                # the transaction is rolled back and the row retried
+                raise
+            raise TreeSaveException('main instance save failed: %s' % (err))
         except Exception, err:
             raise TreeSaveException('main instance save failed: %s' % (err))
 
         leaf.set_instance(instance)
+        if self.journal:
+            entry = journal_entry(instance, created,
+                                  not created and before_image(instance, before)
+                                  or '')
+            if entry:
+                self.journal_pending.append(entry)
+        if created and self.consistent and \
+           self.lookup_database != self.database:
+            self.created_keys.add(self.match_key(leaf, self.match_dict(leaf)))
+        if cache_match:
+            # after the save, as its post_save clears the row's keys
+            self.lookup_cache.set(leaf.get_model(), cache_match, instance.pk)
 
         # add m2m fields to the main instance
         for field, m2m_list in leaf.get_m2ms():
@@ -538,6 +1475,10 @@ class Command(LabelCommand):
                 else:
                     try:
                         instance.__getattribute__(field.name).add(m2m_instance)
+                    except DatabaseError, err:
+                        if is_lock_error(err):
+                            raise
+                        self.loglist.append('Couldnt add m2m %s to %s : %s.' % (field.name, instance, err))
                     except Exception, err:
                         self.loglist.append('Couldnt add m2m %s to %s : %s.' % (field.name, instance, err))
 
@@ -587,32 +1528,25 @@ class Command(LabelCommand):
 
     def __csvfile(self, datafile):
         """ Detect file encoding and open appropriately """
-        filehandle = open(datafile)
-        if not self.charset:
-            diagnose = chardet.detect(filehandle.read())
-            self.charset = diagnose['encoding']
         try:
-            csvfile = codecs.open(datafile, 'r', self.charset)
+            reader = get_reader(datafile, charset=self.charset,
+                                backend=self.reader, **self.reader_options)
         except IOError:
             self.error('Could not open specified csv file, %s, or it does not exist' % datafile, 0)
         else:
-            # CSV Reader returns an iterable, but as we possibly need to
+            self.charset = reader.charset
+            if self.reader not in ('auto', reader.name):
+                self.loglist.append('The %s reader is not installed so using'
+                                    ' the %s reader' % (self.reader,
+                                                        reader.name))
+            # The pipeline reads rows lazily in its own thread, as do
+            # streamed readers so whole documents are never in memory,
+            # otherwise the reader returns an iterable, but as we possibly need to
             # perform list commands and since list is an acceptable iterable,
             # we'll just transform it.
-            return list(self.charset_csv_reader(csv_data=csvfile,
-                                                charset=self.charset))
-
-    def charset_csv_reader(self, csv_data, dialect=csv.excel,
-                           charset='utf-8', **kwargs):
-        csv_reader = csv.reader(self.charset_encoder(csv_data, charset),
-                                dialect=dialect, **kwargs)
-        for row in csv_reader:
-            # decode charset back to Unicode, cell by cell:
-            yield [unicode(cell, charset) for cell in row]
-
-    def charset_encoder(self, csv_data, charset='utf-8'):
-        for line in csv_data:
-            yield line.encode(charset)
+            if self.pipeline or reader.streamed:
+                return iter(reader)
+            return list(reader)
 
     def __mappings(self, mapping_string):
         """
@@ -645,6 +1579,26 @@ class Command(LabelCommand):
             #mappings[ind] = tuple(mappings[ind])
         return mappings
 
+def order_targets(targets):
+    """ Sort (model, mappings) targets so each model comes after the
+        targets it has foreign keys to. Cycles keep their given order.
+    """
+    remaining = list(targets)
+    ordered = []
+    while remaining:
+        target_models = [model for model, mappings in remaining]
+        for target in remaining:
+            parents = [field.rel.to for field in target[0]._meta.fields
+                       if field.rel and field.rel.to is not target[0]]
+            if not [parent for parent in parents if parent in target_models]:
+                break
+        else:
+            # fk cycle so just take the next one
+            target = remaining[0]
+        remaining.remove(target)
+        ordered.append(target)
+    return ordered
+
 class FatalError(Exception):
     """
     Something really bad happened.
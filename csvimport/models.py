@@ -3,12 +3,37 @@ from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 
 fs = FileSystemStorage(location=settings.MEDIA_ROOT)
-CHOICES = (('manual','manual'),('cronjob','cronjob'))
+CHOICES = (('manual','manual'),('cronjob','cronjob'),('follow','follow'))
+
+class LazyModelChoices(object):
+    """ Iterable of app_label.model_name choices that is only built on
+        first use - so importing csvimport does not load every app's models
+        Note no __len__ is defined so a truth test does not trigger the load
+    """
+
+    def __init__(self, exclude=('contenttypes',)):
+        self.exclude = exclude
+        self._choices = None
+
+    def get_choices(self):
+        """ Build the choices, only caching them once the app cache is
+            fully populated, so a partial list is never kept
+        """
+        if self._choices is not None:
+            return self._choices
+        names = ['%s.%s' % (m._meta.app_label, m.__name__)
+                 for m in models.loading.get_models()
+                 if m._meta.app_label not in self.exclude]
+        choices = tuple([(name, name) for name in names])
+        if models.loading.app_cache_ready():
+            self._choices = choices
+        return choices
+
+    def __iter__(self):
+        return iter(self.get_choices())
+
 # Create your models here.
-MODELS = ['%s.%s' % (m._meta.app_label, 
-                     m.__name__) for m in models.loading.get_models() 
-                     if m._meta.app_label != 'contenttypes']
-MODELS = tuple([(m, m) for m in MODELS])
+MODELS = LazyModelChoices()
 
 class CSVImport(models.Model):
     """ Logging model for importing files """
@@ -29,12 +54,38 @@ class CSVImport(models.Model):
     import_date = models.DateField(auto_now=True)
     import_user = models.CharField(max_length=255, default='anonymous',
                                    help_text='User id as text', blank=True)
+    database = models.CharField(max_length=100, blank=True,
+                                help_text='Database alias to import to, if not default')
+    lookup_database = models.CharField(max_length=100, blank=True,
+                        help_text='''Database alias, eg. a replica, to match
+                                     existing rows on, if not the import database''')
+    follow_offset = models.BigIntegerField(default=0,
+                        help_text='Bytes of the file imported so far by --follow')
+    follow_header = models.TextField(blank=True,
+                        help_text='Header row of the file for --follow')
 
     def __unicode__(self):
         return self.upload_file.name
 
 class ImportModel(models.Model):
-    """ Optional one to one mapper of import file to Model """
+    """ Optional one to one mapper of import file to Model
+        Also the journal of rows an import created or updated, for
+        rolling it back, see csvimport.rollback
+    """
     csvimport = models.ForeignKey(CSVImport)
     numeric_id = models.PositiveIntegerField()
     natural_key = models.CharField(max_length=100)
+    model_name = models.CharField(max_length=255, blank=True)
+    created = models.BooleanField(default=True)
+    before_image = models.TextField(blank=True,
+                        help_text='JSON of the fields an update changed, as they were before')
+
+class ImportLock(models.Model):
+    """ Match keys of rows being created, to lock them on databases
+        with no advisory locks, see csvimport.keylocks
+    """
+    key = models.CharField(max_length=32, unique=True)
+
+# Clear cached foreign key lookups when their rows change, see lookupcache
+from csvimport.lookupcache import connect_models
+connect_models()
@@ -0,0 +1,112 @@
+""" Threaded producer / consumer stages linked by bounded queues """
+import sys
+import threading
+from Queue import Queue, Empty, Full
+
+# Marks the end of the rows passed down the queues
+DONE = object()
+
+class StageFailure(object):
+    """ Carries an exception raised in a stage thread down to the caller """
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+    def reraise(self):
+        raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+class Pipeline(object):
+    """ Iterate a source and a chain of stage functions each in its own
+        thread, yielding the output of the last stage in the calling thread.
+
+        Stages are linked by queues of at most maxsize items, so a slow
+        consumer holds back the producers rather than letting them
+        buffer the whole file. Order is kept since each stage is one thread.
+
+        >>> list(Pipeline(range(3), [lambda x: x * 2]))
+        [0, 2, 4]
+    """
+
+    def __init__(self, source, stages=(), maxsize=100, timeout=0.1):
+        self.source = source
+        self.stages = list(stages)
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def put(self, queue, item):
+        """ Block until there is room on the queue, unless the
+            pipeline has been stopped
+        """
+        while not self.stopped.is_set():
+            try:
+                queue.put(item, True, self.timeout)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(self, queue):
+        """ Block until there is an item on the queue, unless the
+            pipeline has been stopped
+        """
+        while not self.stopped.is_set():
+            try:
+                return queue.get(True, self.timeout)
+            except Empty:
+                continue
+        return DONE
+
+    def produce(self, outqueue):
+        """ Feed the source into the first queue """
+        try:
+            for item in self.source:
+                if not self.put(outqueue, item):
+                    return
+        except Exception:
+            self.put(outqueue, StageFailure(sys.exc_info()))
+            return
+        self.put(outqueue, DONE)
+
+    def transform(self, func, inqueue, outqueue):
+        """ Apply func to each item from inqueue putting the result
+            on outqueue, passing on the end marker or any failure
+        """
+        while True:
+            item = self.get(inqueue)
+            if item is DONE or isinstance(item, StageFailure):
+                self.put(outqueue, item)
+                return
+            try:
+                result = func(item)
+            except Exception:
+                self.put(outqueue, StageFailure(sys.exc_info()))
+                return
+            if not self.put(outqueue, result):
+                return
+
+    def start(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def __iter__(self):
+        queues = [Queue(self.maxsize) for i in range(len(self.stages) + 1)]
+        self.start(self.produce, queues[0])
+        for i, func in enumerate(self.stages):
+            self.start(self.transform, func, queues[i], queues[i + 1])
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is DONE:
+                    break
+                if isinstance(item, StageFailure):
+                    item.reraise()
+                yield item
+        finally:
+            # Release any stage still blocked on a queue
+            self.stopped.set()
+            for thread in self.threads:
+                thread.join()
@@ -0,0 +1,43 @@
+""" Save model instances without calling save() or sending signals """
+from django.db import connections, transaction, router
+from django.db.models import AutoField
+
+def raw_save(instance, using=None):
+    """ Write the instance's row directly, as Model.save_base does but
+        without any save() override or pre_save / post_save signals.
+        An instance with a primary key is updated, or inserted if no row
+        was updated. Models with multi-table inheritance parents are not
+        supported so are saved as normal.
+        Returns whether the row was inserted.
+    """
+    model = instance.__class__
+    meta = model._meta
+    using = using or router.db_for_write(model, instance=instance)
+    if meta.parents or meta.proxy:
+        created = instance._state.adding
+        instance.save(using=using)
+        return created
+    connection = connections[using]
+    manager = model._base_manager.db_manager(using)
+    pk_val = instance._get_pk_val(meta)
+    created = True
+    if pk_val is not None:
+        non_pks = [f for f in meta.local_fields if not f.primary_key]
+        if non_pks:
+            values = [(f, None, f.pre_save(instance, False)) for f in non_pks]
+            created = not manager.filter(pk=pk_val)._update(values)
+        else:
+            created = not manager.filter(pk=pk_val).exists()
+    if created:
+        update_pk = bool(meta.has_auto_field and pk_val is None)
+        values = [(f, f.get_db_prep_save(f.pre_save(instance, True),
+                                         connection=connection))
+                  for f in meta.local_fields
+                  if not (update_pk and isinstance(f, AutoField))]
+        result = manager._insert(values, return_id=update_pk, using=using)
+        if update_pk:
+            setattr(instance, meta.pk.attname, result)
+    transaction.commit_unless_managed(using=using)
+    instance._state.db = using
+    instance._state.adding = False
+    return created
@@ -0,0 +1,367 @@
+""" Readers that turn a file into rows of unicode cells for the importer
+
+    The csv module reader is always available, the arrow reader uses
+    pyarrow's CSV parser if it is installed.
+    Excel workbooks are read with openpyxl, if it is installed, and
+    JSON Lines and fixed width files with the standard library.
+    pyarrow and openpyxl are slow to load, so are only imported when
+    a reader needs them.
+"""
+import os
+import csv
+import json
+import codecs
+import tempfile
+from importlib import import_module
+from itertools import islice
+from datetime import datetime, date
+from chardet.universaldetector import UniversalDetector
+
+from django.utils.datastructures import SortedDict
+
+_optional = {}
+
+def optional_module(name):
+    """ The module, imported on first use, or None if not installed """
+    if name not in _optional:
+        try:
+            _optional[name] = import_module(name)
+        except ImportError:
+            _optional[name] = None
+    return _optional[name]
+
+UTF8 = ('utf-8', 'utf8', 'ascii')
+# Most bytes of a file read to guess its charset, and the read size
+CHARSET_SAMPLE = 4 * 1024 * 1024
+CHARSET_BLOCK = 64 * 1024
+
+class NoSuchReader(Exception):
+    pass
+
+class BaseReader(object):
+    """ Iterate a file as rows, each a list of unicode cells
+
+        Subclasses implement either rows or batches, where batches
+        yields lists of rows as the parser produces them.
+    """
+    name = ''
+    # streamed readers are iterated by the importer rather than listed
+    streamed = False
+
+    def __init__(self, path, charset='', dialect=csv.excel, batchsize=1000,
+                 **options):
+        self.path = path
+        self.dialect = dialect
+        self.batchsize = batchsize
+        self.reader_options = options
+        self.charset = charset or self.detect_charset()
+
+    def detect_charset(self):
+        """ Use chardet to guess the file encoding from the start of
+            the file, reading no more than CHARSET_SAMPLE bytes
+        """
+        detector = UniversalDetector()
+        filehandle = open(self.path, 'rb')
+        try:
+            read = 0
+            while not detector.done and read < CHARSET_SAMPLE:
+                block = filehandle.read(CHARSET_BLOCK)
+                if not block:
+                    break
+                read += len(block)
+                detector.feed(block)
+            sampled = read >= CHARSET_SAMPLE
+        finally:
+            filehandle.close()
+        detector.close()
+        charset = detector.result['encoding']
+        if sampled and charset == 'ascii':
+            # only the start was read, and utf-8 is a superset of it
+            charset = 'utf-8'
+        return charset
+
+    def __iter__(self):
+        return self.rows()
+
+    def rows(self):
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def batches(self):
+        batch = []
+        for row in self.rows():
+            batch.append(row)
+            if len(batch) >= self.batchsize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+class CSVReader(BaseReader):
+    """ Read with the csv module, which needs byte strings
+        so lines are encoded to the charset then each cell decoded back
+    """
+    name = 'csv'
+
+    def rows(self):
+        csv_data = codecs.open(self.path, 'r', self.charset)
+        try:
+            csv_reader = csv.reader(self.encode(csv_data),
+                                    dialect=self.dialect)
+            for row in csv_reader:
+                # blank lines are skipped, as the arrow reader does
+                if not row:
+                    continue
+                # decode charset back to Unicode, cell by cell:
+                yield [unicode(cell, self.charset) for cell in row]
+        finally:
+            csv_data.close()
+
+    def encode(self, csv_data):
+        for line in csv_data:
+            yield line.encode(self.charset)
+
+class ArrowReader(BaseReader):
+    """ Read with pyarrow's C++ parser, streaming the file a block at a
+        time and yielding a batch of rows per record batch. The
+        streaming reader parses on one thread - only pyarrow versions
+        without it, which read the whole table, use more.
+        Every column is read as a string so the values match the csv reader.
+        Arrow only parses UTF-8 so other charsets are transcoded first.
+        Arrow needs every row to have the header's number of cells, so
+        from a row that does not the rest is read with the csv reader.
+    """
+    name = 'arrow'
+
+    def header_length(self, path):
+        """ Number of columns, taken from the first row """
+        for row in CSVReader(path, charset='utf-8', dialect=self.dialect):
+            return len(row)
+        return 0
+
+    def options(self, path):
+        pyarrow = optional_module('pyarrow')
+        arrow_csv = optional_module('pyarrow.csv')
+        names = ['f%d' % i for i in range(self.header_length(path))]
+        dialect = self.dialect
+        quote_char = dialect.quotechar
+        if dialect.quoting == csv.QUOTE_NONE:
+            quote_char = False
+        read_options = arrow_csv.ReadOptions(use_threads=True,
+                                             column_names=names)
+        parse_options = arrow_csv.ParseOptions(
+                            delimiter=dialect.delimiter,
+                            quote_char=quote_char,
+                            double_quote=dialect.doublequote,
+                            escape_char=dialect.escapechar or False,
+                            newlines_in_values=True,
+                            ignore_empty_lines=True)
+        convert_options = arrow_csv.ConvertOptions(
+                            column_types=dict([(name, pyarrow.string())
+                                               for name in names]),
+                            strings_can_be_null=False)
+        return dict(read_options=read_options, parse_options=parse_options,
+                    convert_options=convert_options)
+
+    def transcode(self):
+        """ Write a UTF-8 copy of the file for arrow to read """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        outfile = os.fdopen(handle, 'wb')
+        infile = codecs.open(self.path, 'r', self.charset)
+        try:
+            for line in infile:
+                outfile.write(line.encode('utf-8'))
+        finally:
+            infile.close()
+            outfile.close()
+        return path
+
+    def record_batches(self, path):
+        arrow_csv = optional_module('pyarrow.csv')
+        options = self.options(path)
+        if hasattr(arrow_csv, 'open_csv'):
+            # Streaming reader, so the whole table is never in memory
+            return arrow_csv.open_csv(path, **options)
+        return arrow_csv.read_csv(path, **options).to_batches()
+
+    def batches(self):
+        path = self.path
+        if (self.charset or '').lower() not in UTF8:
+            path = self.transcode()
+        done = 0
+        try:
+            try:
+                for batch in self.record_batches(path):
+                    columns = [column.to_pylist() for column in batch.columns]
+                    rows = [list(row) for row in zip(*columns)]
+                    done += len(rows)
+                    yield rows
+            except optional_module('pyarrow').ArrowInvalid:
+                # eg. a row with more or fewer cells than the header
+                for batch in self.csv_batches(done):
+                    yield batch
+        finally:
+            if path != self.path:
+                os.remove(path)
+
+    def csv_batches(self, start):
+        """ Batches of the rows from start on, read with the csv reader """
+        reader = CSVReader(self.path, charset=self.charset,
+                           dialect=self.dialect)
+        batch = []
+        for row in islice(reader.rows(), start, None):
+            batch.append(row)
+            if len(batch) >= self.batchsize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def cell_text(value):
+    """ A cell value as the unicode the csv reader would give """
+    if value is None:
+        return u''
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, bool):
+        return unicode(value)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (datetime, date)):
+        # the format TempModel.clean reads dates in
+        return unicode(value.strftime('%d/%m/%Y'))
+    if isinstance(value, (list, dict)):
+        return unicode(json.dumps(value))
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+class XLSXReader(BaseReader):
+    """ Stream the rows of an Excel workbook with openpyxl's read only
+        mode, from the sheet option or the active sheet.
+        Dates are given as dd/mm/yyyy, as the importer parses them.
+    """
+    name = 'xlsx'
+    streamed = True
+
+    def detect_charset(self):
+        # the cells are unicode already
+        return 'utf-8'
+
+    def rows(self):
+        openpyxl = optional_module('openpyxl')
+        workbook = openpyxl.load_workbook(self.path, read_only=True,
+                                          data_only=True)
+        try:
+            sheet = self.reader_options.get('sheet')
+            if sheet:
+                worksheet = workbook[sheet]
+            else:
+                worksheet = workbook.active
+            for row in worksheet.iter_rows():
+                cells = [cell_text(cell.value) for cell in row]
+                # blank rows are skipped, as the csv reader does
+                if any(cells):
+                    yield cells
+        finally:
+            if hasattr(workbook, 'close'):
+                workbook.close()
+
+class JSONLinesReader(BaseReader):
+    """ Read a JSON value per line, each an object or a list of cells.
+        The first object's keys, in order, are given as the header row
+        and each object's values in that order - keys not in the first
+        object are left out. Lists are rows as they are.
+    """
+    name = 'jsonl'
+    streamed = True
+
+    def detect_charset(self):
+        # JSON text is UTF-8, so the file need not be read to guess
+        return 'utf-8'
+
+    def rows(self):
+        lines = codecs.open(self.path, 'r', self.charset)
+        header = None
+        try:
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                value = json.loads(line, object_pairs_hook=SortedDict)
+                if isinstance(value, dict):
+                    if header is None:
+                        header = value.keys()
+                        yield [cell_text(key) for key in header]
+                    yield [cell_text(value.get(key)) for key in header]
+                elif isinstance(value, list):
+                    yield [cell_text(cell) for cell in value]
+                else:
+                    yield [cell_text(value)]
+        finally:
+            lines.close()
+
+class FixedWidthReader(BaseReader):
+    """ Split each line of a fixed width file at the widths option,
+        a list of column widths or a comma separated string of them,
+        stripping the cells. The first line is the header as for CSV.
+    """
+    name = 'fixed'
+    streamed = True
+
+    def widths(self):
+        widths = self.reader_options.get('widths') or ()
+        if isinstance(widths, basestring):
+            widths = [width for width in widths.split(',') if width.strip()]
+        widths = [int(width) for width in widths]
+        if not widths:
+            raise NoSuchReader('The fixed width reader needs the column widths')
+        return widths
+
+    def rows(self):
+        slices = []
+        start = 0
+        for width in self.widths():
+            slices.append((start, start + width))
+            start += width
+        lines = codecs.open(self.path, 'r', self.charset)
+        try:
+            for line in lines:
+                line = line.rstrip('\r\n')
+                if not line.strip():
+                    continue
+                yield [line[begin:end].strip() for begin, end in slices]
+        finally:
+            lines.close()
+
+READERS = {'csv': CSVReader,
+           'arrow': ArrowReader,
+           'xlsx': XLSXReader,
+           'jsonl': JSONLinesReader,
+           'fixed': FixedWidthReader}
+
+# File extensions the auto reader picks a reader by
+EXTENSIONS = {'.xlsx': 'xlsx',
+              '.xlsm': 'xlsx',
+              '.jsonl': 'jsonl',
+              '.ndjson': 'jsonl'}
+
+def get_reader(path, charset='', backend='csv', **kwargs):
+    """ Return a reader for the path using the backend name,
+        where auto picks one by the file extension, or for CSV arrow if
+        pyarrow is installed.
+        Falls back to the csv reader if pyarrow is not installed.
+    """
+    if backend == 'auto':
+        extension = os.path.splitext(path)[1].lower()
+        backend = EXTENSIONS.get(extension) or \
+                  optional_module('pyarrow.csv') and 'arrow' or 'csv'
+    if backend not in READERS:
+        raise NoSuchReader('There is no %s reader, use one of %s' % (
+                           backend, ', '.join(sorted(READERS))))
+    if backend == 'arrow' and optional_module('pyarrow.csv') is None:
+        backend = 'csv'
+    if backend == 'xlsx' and optional_module('openpyxl') is None:
+        raise NoSuchReader('The xlsx reader needs openpyxl installed')
+    return READERS[backend](path, charset=charset, **kwargs)
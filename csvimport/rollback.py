@@ -0,0 +1,218 @@
+""" Journal the rows an import creates or updates, as ImportModel rows,
+    so the import can be rolled back with set based updates and deletes
+
+    Updated rows keep a before image of just the fields the import
+    changed, as JSON. Many to many links are not journalled, except that
+    those of deleted rows go with them.
+"""
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction, IntegrityError, \
+     DEFAULT_DB_ALIAS
+from django.db.models.sql.subqueries import DeleteQuery
+from django.utils import simplejson
+
+from csvimport.lookupcache import forget
+
+# Rows per update or delete statement
+ROLLBACK_CHUNK = 500
+# Example rows given for references to created rows
+EXAMPLES = 5
+
+def model_label(model):
+    return '%s.%s' % (model._meta.app_label, model.__name__)
+
+def snapshot(instance, fields):
+    """ Values of the fields before the import sets them """
+    return [(field, getattr(instance, field.attname)) for field in fields]
+
+def before_image(instance, snapshot):
+    """ JSON of the snapshot values the instance has since changed,
+        or '' if none have
+    """
+    image = {}
+    for field, value in snapshot:
+        if getattr(instance, field.attname) != value:
+            image[field.name] = value
+    if not image:
+        return ''
+    return simplejson.dumps(image, cls=DjangoJSONEncoder, sort_keys=True)
+
+def journal_entry(instance, created, before=''):
+    """ Entry for write_journal, or None if there is nothing to undo """
+    if not (created or before):
+        return None
+    return (model_label(instance.__class__), instance.pk, created, before)
+
+def write_journal(csvimportid, entries, using=DEFAULT_DB_ALIAS):
+    """ Insert the entries as ImportModel rows with one executemany """
+    from csvimport.models import ImportModel
+    if not entries:
+        return
+    meta = ImportModel._meta
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    names = ['csvimport', 'numeric_id', 'natural_key', 'model_name', 'created',
+             'before_image']
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote(meta.db_table),
+        ', '.join([quote(meta.get_field(name).column) for name in names]),
+        ', '.join(['%s'] * len(names)))
+    rows = []
+    for label, pk, created, before in entries:
+        numeric_id = isinstance(pk, (int, long)) and pk > 0 and pk or 0
+        rows.append((csvimportid, numeric_id, unicode(pk), label, created,
+                     before))
+    cursor = connection.cursor()
+    cursor.executemany(sql, rows)
+    transaction.commit_unless_managed(using=using)
+
+def decode_image(model, before):
+    """ Field values to restore from a before image """
+    values = {}
+    for name, value in simplejson.loads(before).items():
+        field = model._meta.get_field(name)
+        if value is not None:
+            if field.rel:
+                value = field.rel.get_related_field().to_python(value)
+            else:
+                value = field.to_python(value)
+        values[name] = value
+    return values
+
+def chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def references(created, using=DEFAULT_DB_ALIAS, chunksize=ROLLBACK_CHUNK):
+    """ Messages for rows the import did not create whose foreign keys
+        refer to rows it did, which would stop those being deleted.
+        created maps models to the primary keys of their created rows.
+    """
+    messages = []
+    for model, pks in created.items():
+        for related in model._meta.get_all_related_objects():
+            child = related.model
+            own = set(created.get(child, ()))
+            lookup = '%s__%s__in' % (related.field.name, model._meta.pk.name)
+            found = []
+            for chunk in chunks(pks, chunksize):
+                rows = child._base_manager.using(using).filter(
+                    **{lookup: chunk}).values_list('pk', flat=True)
+                found.extend([pk for pk in rows if pk not in own])
+            if found:
+                messages.append('%s %s rows refer to %s rows the import'
+                                ' created by %s, eg. %s' % (
+                                    len(found), child.__name__,
+                                    model.__name__, related.field.name,
+                                    ', '.join([unicode(pk) for pk in
+                                               found[:EXAMPLES]])))
+    return messages
+
+def link_fields(model):
+    """ (through model, field) of the auto created m2m tables that link
+        to the model's rows, from either side
+    """
+    fields = []
+    for field in model._meta.many_to_many:
+        through = field.rel.through
+        if through._meta.auto_created:
+            fields.append((through, through._meta.get_field(
+                field.m2m_field_name())))
+    for related in model._meta.get_all_related_many_to_many_objects():
+        through = related.field.rel.through
+        if through._meta.auto_created:
+            fields.append((through, through._meta.get_field(
+                related.field.m2m_reverse_field_name())))
+    return fields
+
+def rollback(csvimportid, using=DEFAULT_DB_ALIAS, chunksize=ROLLBACK_CHUNK):
+    """ Undo an import from its journal in one transaction, restoring
+        the rows it updated to how they were before it and deleting the
+        rows it created - children first, with their m2m links.
+        The before images of a row are merged, keeping each field's
+        earliest value, and rows sharing the merged image are restored
+        by the same update.
+        Nothing is changed if other rows refer to the created rows.
+        The lookup cache entries of the rows are cleared, as the updates
+        and deletes send no signals. Returns messages for the import log.
+    """
+    from csvimport.models import ImportModel
+    messages = []
+    created = {}
+    order = []
+    restores = {}
+    journal = ImportModel.objects.using(using).filter(
+        csvimport=csvimportid).order_by('id')
+    for label, pk, was_created, before in journal.values_list(
+            'model_name', 'natural_key', 'created', 'before_image').iterator():
+        model = models.get_model(*(label.split('.', 1) + [''])[:2])
+        if not model:
+            messages.append('Rollback skipped %s %s as the model could not be'
+                            ' found' % (label, pk))
+            continue
+        pk = model._meta.pk.to_python(pk)
+        if was_created:
+            if model not in created:
+                created[model] = []
+                order.append(model)
+            created[model].append(pk)
+        else:
+            # each image holds only the fields its row changed, and the
+            # first of a field's values is the row before the import
+            image = restores.setdefault((model, pk), {})
+            for name, value in simplejson.loads(before).items():
+                image.setdefault(name, value)
+
+    groups = {}
+    for (model, pk), image in restores.items():
+        if pk not in created.get(model, ()):
+            before = simplejson.dumps(image, sort_keys=True)
+            groups.setdefault((model, before), []).append(pk)
+    blocking = references(created, using, chunksize)
+    if blocking:
+        return messages + blocking + [
+            'Import %s was not rolled back, as rows it created are still'
+            ' referred to' % csvimportid]
+    restored = deleted = 0
+    try:
+        with transaction.commit_on_success(using=using):
+            for (model, before), pks in groups.items():
+                values = decode_image(model, before)
+                for chunk in chunks(pks, chunksize):
+                    restored += model._base_manager.using(using).filter(
+                        pk__in=chunk).update(**values)
+            # models are first created parents first, so delete in reverse
+            for model in reversed(order):
+                through_fields = link_fields(model)
+                for chunk in chunks(created[model], chunksize):
+                    for through, field in through_fields:
+                        DeleteQuery(through).delete_batch(chunk, using,
+                                                          field=field)
+                    DeleteQuery(model).delete_batch(chunk, using)
+                    deleted += len(chunk)
+            meta = ImportModel._meta
+            quote = connections[using].ops.quote_name
+            cursor = connections[using].cursor()
+            cursor.execute('DELETE FROM %s WHERE %s = %%s' % (
+                quote(meta.db_table),
+                quote(meta.get_field('csvimport').column)), [csvimportid])
+    except IntegrityError, err:
+        return messages + ['Import %s was not rolled back (%s)' % (
+            csvimportid, err)]
+    for (model, before), pks in groups.items():
+        forget(model, using, pks)
+    for model in order:
+        forget(model, using, created[model])
+    messages.append('Rolled back import %s, restoring %s updated rows and'
+                    ' deleting %s created rows' % (csvimportid, restored,
+                                                   deleted))
+    return messages
+
+def rollback_import(csvimport):
+    """ Roll back a CSVImport, adding the messages to its log """
+    messages = rollback(csvimport.id,
+                        using=csvimport.database or DEFAULT_DB_ALIAS)
+    csvimport.error_log = '\n'.join(filter(None, [csvimport.error_log] +
+                                           messages))
+    csvimport.save()
+    return messages
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent once per chunk of rows written with raw saves, which skip the
+# model's save() and its pre_save / post_save signals. The sender is the
+# model, instances the saved instances and created whether each was
+# inserted, so listeners can eg. reindex the chunk in bulk.
+batch_saved = Signal(providing_args=['instances', 'created', 'using'])
@@ -0,0 +1,112 @@
+""" External merge sort for rows that may not fit in memory """
+import sys
+import heapq
+import tempfile
+import cPickle as pickle
+
+# Most spilled runs merged at once
+MERGE_WIDTH = 64
+
+class ExternalSort(object):
+    """ Sort items by key, holding at most buffersize bytes of them in
+        memory. Past that each sorted run is spilled to a temporary file
+        and the runs are merged back as they are read.
+        Once mergewidth runs of the same size are spilled they are merged
+        into one, so the open files grow with the log of the runs.
+        Items with equal keys keep their original order.
+
+        >>> list(ExternalSort(key=len, buffersize=1).sort(['ab', 'c', 'd']))
+        ['c', 'd', 'ab']
+    """
+
+    def __init__(self, key, buffersize=64 * 1024 * 1024, tempdir=None,
+                 mergewidth=MERGE_WIDTH):
+        self.key = key
+        self.buffersize = buffersize
+        self.tempdir = tempdir
+        self.mergewidth = max(mergewidth, 2)
+        self.runs = 0
+        self.merges = 0
+
+    def sizeof(self, item):
+        """ Rough bytes used by an item, or a list of cells """
+        size = sys.getsizeof(item)
+        if isinstance(item, (list, tuple)):
+            for value in item:
+                size += self.sizeof(value)
+        return size
+
+    def open_spill(self):
+        return tempfile.TemporaryFile(dir=self.tempdir)
+
+    def write(self, entries):
+        """ Write sorted entries to a temporary file """
+        spillfile = self.open_spill()
+        for entry in entries:
+            pickle.dump(entry, spillfile, pickle.HIGHEST_PROTOCOL)
+        spillfile.seek(0)
+        return spillfile
+
+    def spill(self, run):
+        """ Write a sorted run to a temporary file """
+        run.sort()
+        self.runs += 1
+        return self.write(run)
+
+    def merge(self, spillfiles):
+        """ Merge the runs of the spill files into one, closing them """
+        try:
+            merged = self.write(heapq.merge(*[self.read(spillfile)
+                                              for spillfile in spillfiles]))
+        finally:
+            for spillfile in spillfiles:
+                spillfile.close()
+        self.merges += 1
+        return merged
+
+    def add(self, spilled, spillfile):
+        """ Add a spilled run to the (passes, file) list, merging the
+            newest runs while mergewidth of them have had as many passes
+        """
+        spilled.append((0, spillfile))
+        width = self.mergewidth
+        while len(spilled) >= width and spilled[-width][0] == spilled[-1][0]:
+            passes = spilled[-1][0] + 1
+            spillfiles = [spillfile for done, spillfile in spilled[-width:]]
+            del spilled[-width:]
+            spilled.append((passes, self.merge(spillfiles)))
+
+    def read(self, spillfile):
+        while True:
+            try:
+                yield pickle.load(spillfile)
+            except EOFError:
+                return
+
+    def sort(self, items):
+        run = []
+        size = 0
+        spilled = []
+        # decorate with the position so ties are stable
+        # and the items themselves are never compared
+        for position, item in enumerate(items):
+            run.append((self.key(item), position, item))
+            size += self.sizeof(item)
+            if size >= self.buffersize:
+                self.add(spilled, self.spill(run))
+                run = []
+                size = 0
+        run.sort()
+        spillfiles = [spillfile for done, spillfile in spilled]
+        # leave room for the run still in memory in the final merge
+        while len(spillfiles) >= self.mergewidth:
+            merged = self.merge(spillfiles[-self.mergewidth:])
+            spillfiles[-self.mergewidth:] = [merged]
+        try:
+            merged = heapq.merge(run, *[self.read(spillfile)
+                                        for spillfile in spillfiles])
+            for key, position, item in merged:
+                yield item
+        finally:
+            for spillfile in spillfiles:
+                spillfile.close()
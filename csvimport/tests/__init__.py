@@ -1,2 +1,18 @@
 from csvimport.tests.parse_tests import CommandParseTest
-
+from csvimport.tests.startup_tests import StartupTest
+from csvimport.tests.pipeline_tests import PipelineTest
+from csvimport.tests.batching_tests import BatchTunerTest, BatchImportTest
+from csvimport.tests.readers_tests import ReaderTest
+from csvimport.tests.targets_tests import TargetsTest
+from csvimport.tests.sorting_tests import SortingTest
+from csvimport.tests.dedupe_tests import CollapseTest
+from csvimport.tests.indexes_tests import IndexAdviceTest
+from csvimport.tests.bulkload_tests import BulkLoadTest
+from csvimport.tests.rawsave_tests import RawSaveTest
+from csvimport.tests.database_tests import DatabaseTest
+from csvimport.tests.lookupcache_tests import LookupCacheTest
+from csvimport.tests.joins_tests import JoinTest
+from csvimport.tests.follow_tests import FollowTest
+from csvimport.tests.rollback_tests import RollbackTest
+from csvimport.tests.dryrun_tests import DryRunTest
+from csvimport.tests.keylocks_tests import KeyLocksTest
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from django.db import DatabaseError
+from django.db.models.signals import pre_save
+from django.test import TestCase
+
+from csvimport.batching import BatchTuner, is_lock_error
+from csvimport.readers import CSVReader
+from csvimport.tests.models import Country
+from csvimport.tests.utils import fixture, run_import, setup_import
+
+class BatchTunerTest(TestCase):
+    """ Test batch sizes follow the write latency """
+
+    def test_fixed(self):
+        """ Without autotune the size never changes """
+        tuner = BatchTuner(size=50)
+        tuner.record(50, 0.01)
+        tuner.record(50, 10)
+        self.assertEqual(tuner.size, 50)
+
+    def test_autotune(self):
+        """ Grow while the time per row improves, shrink when it gets
+            worse, a batch is slow or there is a lock wait
+        """
+        tuner = BatchTuner(size=10, autotune=True, maxsize=80, slow=1.0)
+        self.assertEqual(tuner.record(10, 0.1), 20)
+        self.assertEqual(tuner.record(20, 0.1), 40)
+        self.assertEqual(tuner.record(40, 0.1), 80)
+        self.assertEqual(tuner.record(80, 0.2), 80)
+        self.assertEqual(tuner.record(80, 0.4), 40)
+        self.assertEqual(tuner.record(40, 1.5), 20)
+        self.assertEqual(tuner.locked(), 10)
+        self.assertTrue(is_lock_error('Lock wait timeout exceeded'))
+        self.assertTrue(is_lock_error('database is locked'))
+        self.assertTrue(is_lock_error('deadlock detected'))
+        self.assertTrue(is_lock_error(DatabaseError(1213, 'Deadlock found')))
+        self.assertFalse(is_lock_error('column code is not unique'))
+        # words that only contain lock
+        self.assertFalse(is_lock_error('duplicate key value violates unique'
+                                       ' constraint "shop_block_code_key"'))
+        self.assertFalse(is_lock_error('column clock_time cannot be null'))
+
+    def test_throttle(self):
+        """ Sleep to keep under the max rows per second """
+        now = [100.0]
+        slept = []
+        tuner = BatchTuner(maxrate=10, clock=lambda: now[0],
+                           sleep=slept.append)
+        tuner.start()
+        now[0] += 1
+        self.assertEqual(tuner.throttle(20), 1.0)
+        now[0] += 5
+        self.assertEqual(tuner.throttle(10), 0)
+        self.assertEqual(slept, [1.0])
+
+class BatchImportTest(TestCase):
+    """ Test batched imports give the same result as row by row """
+
+    def test_batch_import(self):
+        """ Batches start at the batch size and cover every row """
+        errors = run_import('countries.csv')
+        countries = list(Country.objects.order_by('code').values_list())
+        Country.objects.all().delete()
+        cmd = setup_import('countries.csv', batchsize=7, autobatch=True,
+                           pipeline=True)
+        batched = cmd.run(logid=1)
+        self.assertEqual(batched, errors)
+        self.assertEqual(list(Country.objects.order_by('code').values_list()),
+                         countries)
+        sizes = [rows for rows, seconds in cmd.batch_history]
+        self.assertEqual(sizes[0], 7)
+        self.assertEqual(sum(sizes), len(list(CSVReader(
+            fixture('countries.csv')))) - 1)
+
+    def test_lock_wait_on_save(self):
+        """ A lock wait saving a row rolls the batch back, backs off and
+            retries the rows, rather than dropping the row
+        """
+        errors = run_import('countries.csv')
+        count = Country.objects.count()
+        Country.objects.all().delete()
+        waits = []
+
+        def lock_wait(sender, instance, **kwargs):
+            if instance.code == 'AL' and not waits:
+                waits.append(instance.code)
+                raise DatabaseError('Lock wait timeout exceeded')
+
+        pre_save.connect(lock_wait, sender=Country)
+        try:
+            cmd = setup_import('countries.csv', batchsize=8, autobatch=True)
+            batched = cmd.run(logid=1)
+        finally:
+            pre_save.disconnect(lock_wait, sender=Country)
+        self.assertEqual(waits, ['AL'])
+        self.assertTrue('Rows 1 to 8 rolled back on lock wait (Lock wait'
+                        ' timeout exceeded) so retrying each row' in batched)
+        # the tuner halved the batch after the lock wait
+        self.assertEqual(cmd.batch_history[0][0], 4)
+        self.assertEqual(Country.objects.count(), count)
+        self.assertEqual([msg for msg in batched if 'not saved' in msg],
+                         [msg for msg in errors if 'not saved' in msg])
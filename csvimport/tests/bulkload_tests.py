@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from django.core.management.color import no_style
+from django.db import connection, DatabaseError
+from django.test import TransactionTestCase
+
+from csvimport.bulkload import BulkLoad, INDEX_NAME
+from csvimport.tests.models import Country, UnitOfMeasure, Item, Organisation
+from csvimport.tests.utils import run_import
+
+def table_indexes(model):
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA index_list(%s)' % model._meta.db_table)
+    return sorted([row[1] for row in cursor.fetchall()])
+
+class BulkLoadTest(TransactionTestCase):
+    """ Test relaxing indexes and fk checks for bulk loads
+        as a transaction test case since they run DDL
+    """
+
+    def test_indexes(self):
+        """ Non-unique indexes are dropped for the load then rebuilt """
+        indexes = table_indexes(Item)
+        self.assertEqual(len(indexes), 3)
+        bulk = BulkLoad([Item])
+        messages = bulk.start()
+        self.assertEqual(table_indexes(Item), [])
+        self.assertEqual(messages, ['Bulk load dropped indexes %s' %
+            ', '.join([name for model, name, sql in bulk.dropped])])
+        bulk.finish()
+        self.assertEqual(table_indexes(Item), indexes)
+
+    def test_verify(self):
+        """ Rows with fks missing from the parent table are reported """
+        uom = UnitOfMeasure.objects.create(name='Kit')
+        org = Organisation.objects.create(name='Save UK')
+        country = Country.objects.create(code='KE', name='Kenya')
+        item = Item.objects.create(code_share='tent', code_org='RF024',
+                                   uom=uom, organisation=org, country=country)
+        bulk = BulkLoad([Item])
+        self.assertEqual(bulk.verify(Item), [])
+        cursor = connection.cursor()
+        cursor.execute('UPDATE tests_item SET country_id = %s', ['XX'])
+        self.assertEqual(bulk.verify(Item), ['Bulk load check: 1 Item rows'
+            ' have country values missing from Country, eg. %s=XX' % item.pk])
+
+    def test_bulk_import(self):
+        """ Bulk loads give the same rows with the indexes rebuilt """
+        indexes = table_indexes(Item)
+        errors = run_import('test_plain.csv', modelname='tests.Item',
+                            targets=['tests.Organisation:column3=name',
+                                     'tests.Item:column1=code_share,'
+                                     'column2=code_org,column3=organisation.name,'
+                                     'column5=uom.name'],
+                            bulkload=True)
+        self.assertTrue(errors[-1].startswith('Bulk load rebuilt indexes'))
+        # only the country index, as rows are matched on uom and organisation
+        sql = connection.creation.sql_indexes_for_field(
+            Item, Item._meta.get_field('country'), no_style())[0]
+        self.assertTrue('Bulk load dropped indexes %s' % INDEX_NAME.search(
+            sql).group(1) in errors)
+        self.assertEqual(table_indexes(Item), indexes)
+        self.assertEqual(Organisation.objects.count(), 1)
+
+    def test_finish_restores_checks(self):
+        """ Fk checks are switched back on even if a rebuild fails """
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA foreign_keys = ON')
+        try:
+            bulk = BulkLoad([Item])
+            bulk.start()
+            self.assertEqual(cursor.execute('PRAGMA foreign_keys').fetchone(),
+                             (0, ))
+            rebuilds = bulk.dropped
+            bulk.dropped = [(Item, 'broken', 'CREATE INDEX broken ON missing'
+                             ' (id)')] + rebuilds
+            self.assertRaises(DatabaseError, bulk.finish)
+            self.assertEqual(cursor.execute('PRAGMA foreign_keys').fetchone(),
+                             (1, ))
+        finally:
+            cursor.execute('PRAGMA foreign_keys = OFF')
+            for model, name, sql in rebuilds:
+                cursor.execute(sql)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from csvimport.tests.models import UnitOfMeasure
+from csvimport.tests.utils import run_import
+
+class DatabaseTest(TestCase):
+    """ Test writing to and matching on other database aliases """
+    multi_db = True
+
+    def names(self, using):
+        return sorted(UnitOfMeasure.objects.using(using).values_list('name',
+                                                                     flat=True))
+
+    def test_database(self):
+        """ Rows are written to the database alias """
+        run_import('test_plain.csv', modelname='tests.UnitOfMeasure',
+                   mappings='column5=name', database='replica')
+        self.assertEqual(self.names('replica'),
+                         [u'Kit', u'Metre', u'Piece(s)', u'Set'])
+        self.assertEqual(self.names('default'), [])
+
+    def test_lookup_database(self):
+        """ Existing rows are matched on the lookup database, with
+            rows created earlier in the import matched on the primary
+            if consistent
+        """
+        UnitOfMeasure.objects.using('replica').create(name='Set')
+        UnitOfMeasure.objects.create(name='Set')
+        run_import('test_plain.csv', modelname='tests.UnitOfMeasure',
+                   mappings='column5=name', lookup_database='replica',
+                   consistent=True)
+        self.assertEqual(self.names('default'),
+                         [u'Kit', u'Metre', u'Piece(s)', u'Set'])
+        UnitOfMeasure.objects.exclude(name='Set').delete()
+        # without consistent the lagging replica gives duplicates
+        run_import('test_plain.csv', modelname='tests.UnitOfMeasure',
+                   mappings='column5=name', lookup_database='replica')
+        self.assertEqual(self.names('default'),
+                         [u'Kit', u'Metre', u'Piece(s)', u'Piece(s)',
+                          u'Piece(s)', u'Piece(s)', u'Set'])
+        self.assertEqual(self.names('replica'), [u'Set'])
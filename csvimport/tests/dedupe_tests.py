@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from csvimport.dedupe import Collapser, NoSuchRule
+from csvimport.tests.models import UnitOfMeasure
+from csvimport.tests.utils import run_import
+
+ROWS = [[u'tent', u'RF024', u'45'],
+        [u'bucket', u'WA041', u'300'],
+        [u'tent', u'', u'50'],
+        [u'watercan', u'WA017', u''],
+        [u'tent', u'RF025', u'']]
+
+class CollapseTest(TestCase):
+    """ Test collapsing duplicate rows within a file """
+
+    def collapse(self, rule, buffersize=64 * 1024 * 1024):
+        collapser = Collapser(lambda item: item[1][0], rule=rule,
+                              buffersize=buffersize)
+        rows = list(collapser.collapse(enumerate(ROWS)))
+        self.assertEqual((collapser.duplicates, collapser.keys), (2, 1))
+        return rows
+
+    def test_rules(self):
+        """ First, last and merge keep rows in file order """
+        self.assertEqual(self.collapse('first'), [(0, ROWS[0]), (1, ROWS[1]),
+                                                  (3, ROWS[3])])
+        self.assertEqual(self.collapse('last'), [(1, ROWS[1]), (3, ROWS[3]),
+                                                 (4, ROWS[4])])
+        merged = [u'tent', u'RF025', u'50']
+        self.assertEqual(self.collapse('merge'), [(0, merged), (1, ROWS[1]),
+                                                  (3, ROWS[3])])
+        # spilling to disk gives the same result
+        self.assertEqual(self.collapse('merge', buffersize=0),
+                         [(0, merged), (1, ROWS[1]), (3, ROWS[3])])
+        self.assertRaises(NoSuchRule, Collapser, len, 'best')
+
+    def test_blank_keys(self):
+        """ Rows with no key cells set are never collapsed or counted """
+        items = [(0, [u'', u'a']), (1, [u'', u'b']), (2, [u'x', u'c']),
+                 (3, [u'x', u'd'])]
+        for rule, kept in (('first', 2), ('last', 3), ('merge', 2)):
+            collapser = Collapser(lambda item: [item[1][0]], rule=rule)
+            rows = list(collapser.collapse(iter(items)))
+            self.assertEqual(rows[:2], items[:2])
+            self.assertEqual([row_ind for row_ind, row in rows[2:]], [kept])
+            self.assertEqual((collapser.duplicates, collapser.keys), (1, 1))
+
+    def test_collapse_import(self):
+        """ Duplicates are saved once and counted in the log """
+        errors = run_import('test_duplicate.csv',
+                            modelname='tests.UnitOfMeasure',
+                            mappings='column5=name', collapse='first')
+        self.assertEqual(errors[-1], 'Collapsed 3 duplicate rows of 2 match'
+                                     ' keys in the file (first)')
+        self.assertEqual(sorted(UnitOfMeasure.objects.values_list('name',
+                                                                  flat=True)),
+                         [u'Kit', u'Piece(s)', u'Set'])
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from csvimport.tests.models import Country, Item, Organisation, UnitOfMeasure
+from csvimport.tests.utils import ITEM_MAPPINGS, run_import
+
+QUANTITY_MAPPINGS = ITEM_MAPPINGS + ',column6=quantity'
+
+class DryRunTest(TestCase):
+    """ Test checking an import without saving it """
+
+    def dry_run(self, processes, mappings=QUANTITY_MAPPINGS):
+        log = run_import('test_plain.csv', modelname='tests.Item',
+                         mappings=mappings, dry_run=True,
+                         processes=processes)
+        return log[log.index('Dry run of 8 rows, nothing was saved'):]
+
+    def test_projection(self):
+        """ Existing and repeated rows are updates, in a pool or not """
+        UnitOfMeasure.objects.create(name='Set')
+        Country.objects.create(code='Stock', name='In stock')
+        # items differ in quantity so none repeat
+        report = ['Dry run of 8 rows, nothing was saved',
+                  'Country: 2 inserts, 6 updates, 0 failures',
+                  'Organisation: 1 inserts, 7 updates, 0 failures',
+                  'UnitOfMeasure: 3 inserts, 5 updates, 0 failures',
+                  'Item: 8 inserts, 0 updates, 0 failures']
+        self.assertEqual(sorted(self.dry_run(1)), sorted(report))
+        self.assertEqual(sorted(self.dry_run(2)), sorted(report))
+        self.assertEqual(Organisation.objects.count(), 0)
+        self.assertEqual(UnitOfMeasure.objects.count(), 1)
+        self.assertEqual(Item.objects.count(), 0)
+
+    def test_errors(self):
+        """ Errors are counted by column with example rows """
+        report = self.dry_run(1, mappings='column1=code_share,'
+                              'column3=organisation.nom,column5=uom.name,'
+                              'column6=date')
+        self.assertEqual(report[1], 'Column 3: 8 errors, eg. row 1 Model'
+                         ' Organisation has no field nom.; row 2 Model'
+                         ' Organisation has no field nom.; row 3 Model'
+                         ' Organisation has no field nom.; row 4 Model'
+                         ' Organisation has no field nom.; row 5 Model'
+                         ' Organisation has no field nom.')
+        self.assertTrue(report[2].startswith('Column 6: 8 errors, eg. row 1'
+                                             " Could not prepare value '300'"))
+        self.assertTrue(report[3].startswith('Item: 8 errors, eg. row 1 Item'
+                                             ' country is required but not'
+                                             ' set'))
+        # with nothing to match on an organisation is created per row
+        self.assertEqual(report[4:], ['Organisation: 8 inserts, 0 updates,'
+                                      ' 0 failures',
+                                      'UnitOfMeasure: 4 inserts, 4 updates,'
+                                      ' 0 failures',
+                                      'Item: 0 inserts, 0 updates,'
+                                      ' 8 failures'])
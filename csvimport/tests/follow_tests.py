@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+from django.test import TestCase
+
+from csvimport.follow import FollowReader, wait_for_change
+from csvimport.management.commands.csvimport import Command
+from csvimport.models import CSVImport
+from csvimport.tests.models import UnitOfMeasure
+
+class FollowTest(TestCase):
+    """ Test importing only the rows appended to a file """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def append(self, data):
+        csvfile = open(self.path, 'ab')
+        csvfile.write(data)
+        csvfile.close()
+
+    def follow(self):
+        cmd = Command()
+        cmd.handle_label(self.path, model='tests.UnitOfMeasure', follow=True,
+                         charset='utf-8')
+        return CSVImport.objects.get(file_name=self.path)
+
+    def names(self):
+        return sorted(UnitOfMeasure.objects.values_list('name', flat=True))
+
+    def test_reader(self):
+        """ Partial rows are left for the next read """
+        self.append('name\r\nKit\r\n"Set\nof')
+        reader = FollowReader(self.path)
+        self.assertEqual(reader.read(), [[u'name'], [u'Kit']])
+        self.assertEqual(reader.offset, 11)
+        self.append(' 2",x\nMetre')
+        self.assertEqual(reader.read(), [[u'Set\nof 2', u'x']])
+        self.assertEqual(reader.read(), [])
+        self.append('\n')
+        self.assertEqual(reader.read(), [[u'Metre']])
+        self.assertFalse(reader.truncated())
+
+    def test_chunks(self):
+        """ Reads take a chunk of rows, or one row if it is longer """
+        self.append('name\nKit\nSet\nPiece(s) of tent\nBox\nMet')
+        reader = FollowReader(self.path, chunksize=9)
+        self.assertEqual(reader.read(), [[u'name'], [u'Kit']])
+        self.assertEqual(reader.read(), [[u'Set']])
+        self.assertEqual(reader.read(), [[u'Piece(s) of tent']])
+        self.assertEqual(reader.read(), [[u'Box']])
+        self.assertEqual(reader.read(), [])
+        self.assertEqual(reader.offset, 34)
+        self.assertEqual(reader.seen, 37)
+
+    def test_follow(self):
+        """ Each follow imports the new rows, keeping the header """
+        self.append('name\nKit\nSet\nMet')
+        record = self.follow()
+        self.assertEqual(self.names(), [u'Kit', u'Set'])
+        self.assertEqual(record.follow_header, u'name')
+        self.assertEqual(record.follow_offset, 13)
+        # the partial row is not a change to wait for
+        self.assertFalse(wait_for_change(self.path, 16, 0.01))
+        self.assertTrue(wait_for_change(self.path, 13, 0.01))
+        self.append('re\nPiece(s)\n')
+        record = self.follow()
+        self.assertEqual(self.names(), [u'Kit', u'Metre', u'Piece(s)',
+                                        u'Set'])
+        self.assertEqual(record.follow_offset, 28)
+        self.assertTrue('Imported 2 rows from byte 13 of the file'
+                        in record.error_log)
+        # nothing new leaves the record as it is
+        CSVImport.objects.update(error_log='unchanged')
+        record = self.follow()
+        self.assertEqual(UnitOfMeasure.objects.count(), 4)
+        self.assertEqual(record.error_log, 'unchanged')
+        # a replaced file is imported from the start
+        open(self.path, 'wb').write('name\nBox\n')
+        record = self.follow()
+        self.assertEqual(UnitOfMeasure.objects.count(), 5)
+        self.assertEqual(record.follow_offset, 9)
+        self.assertEqual(CSVImport.objects.count(), 1)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import re
+
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+
+from csvimport.indexes import match_plan, advise, create_index, drop_index, \
+     table_indexes
+from csvimport.tests.models import Country, UnitOfMeasure, Item, Organisation
+from csvimport.tests.utils import run_import
+
+class IndexAdviceTest(TransactionTestCase):
+    """ Test advice on unindexed match fields and temporary indexes
+        as a transaction test case since they run DDL
+    """
+
+    def test_match_plan(self):
+        """ Each model looked up gets the fields set on it """
+        mappings = [(['code_share'], '1'), (['organisation', 'name'], '3'),
+                    (['uom', 'name'], '5'), (['description'], '4')]
+        self.assertEqual(match_plan(Item, mappings),
+                         [(Item, ['code_share', 'organisation', 'uom',
+                                  'description']),
+                          (Organisation, ['name']),
+                          (UnitOfMeasure, ['name'])])
+        # Item matches on its indexed fks, Country on its unique code
+        advice = advise(Item, mappings)
+        self.assertEqual([(model, [field.name for field in fields])
+                          for model, fields, msg in advice],
+                         [(Organisation, ['name']), (UnitOfMeasure, ['name'])])
+        self.assertTrue(advice[0][2].endswith('CREATE INDEX '
+            'tests_organisation_csvimport_b068931c ON tests_organisation (name)'))
+        self.assertEqual(advise(Country, [(['code'], '1'), (['name'], '2')]),
+                         [])
+
+    def test_matchindex_import(self):
+        """ The temporary index is added for the import then dropped """
+        errors = run_import('test_plain.csv', modelname='tests.Organisation',
+                            mappings='column3=name', matchindex=True)
+        self.assertEqual(errors[0], 'Using manually entered mapping list')
+        name = re.match('Added temporary index (csvimport_tmp_\w+_'
+                        'tests_organisation) on tests_organisation \(name\)$',
+                        errors[1]).group(1)
+        self.assertEqual(errors[2:], ['Dropped temporary index %s' % name])
+        self.assertEqual(Organisation.objects.count(), 1)
+        self.assertEqual(table_indexes(Organisation), [])
+
+    def test_concurrent_indexes(self):
+        """ Imports at once add their own index and drop only their own """
+        fields = [Organisation._meta.get_field('name')]
+        first = create_index(Organisation, fields, token='first')
+        second = create_index(Organisation, fields, token='second')
+        self.assertNotEqual(first, second)
+        # another import's temporary index is not taken as the advised one
+        self.assertEqual(len(advise(Organisation, [(['name'], '3')])), 1)
+        drop_index(Organisation, first)
+        self.assertEqual(table_indexes(Organisation), [(second, ['name'])])
+        drop_index(Organisation, second)
+
+    def test_index_added_by_hand(self):
+        """ Following the advice silences it and --matchindex adds nothing """
+        advice = advise(Organisation, [(['name'], '3')])
+        cursor = connection.cursor()
+        cursor.execute(advice[0][2].split('or ')[-1])
+        transaction.commit_unless_managed()
+        try:
+            self.assertEqual(advise(Organisation, [(['name'], '3')]), [])
+            errors = run_import('test_plain.csv',
+                                modelname='tests.Organisation',
+                                mappings='column3=name', matchindex=True)
+            self.assertEqual(errors, ['Using manually entered mapping list'])
+        finally:
+            cursor.execute('DROP INDEX tests_organisation_csvimport_b068931c')
+            transaction.commit_unless_managed()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from django.test import TestCase
+
+from csvimport.joins import chain_lookups, resolve
+from csvimport.management.commands.csvimport import TempModel
+from csvimport.tests.models import Country, Warehouse, Delivery, Item, \
+     Organisation, Stocktake, UnitOfMeasure
+from csvimport.tests.utils import run_import
+
+DELIVERY_MAPPINGS = ('column5=uom.name,column6=quantity,'
+                     'column7=warehouse.country.code')
+
+class JoinTest(TestCase):
+    """ Test chains of foreign keys are linked with joined queries """
+
+    def setUp(self):
+        for code in ('Stock', 'On Order'):
+            country = Country.objects.create(code=code, name=code)
+            Warehouse.objects.create(name='%s warehouse' % code,
+                                     country=country)
+
+    def test_chain_lookups(self):
+        """ Only leaves setting one foreign key down to values are chains """
+        delivery = TempModel(Delivery)
+        warehouse = delivery.add_fk('warehouse')
+        warehouse.add_fk('country').add_value('code', 'Stock')
+        self.assertEqual(chain_lookups(warehouse),
+                         (('country__code', ), ('Stock', )))
+        uom = delivery.add_fk('uom')
+        uom.add_value('name', 'Kit')
+        self.assertEqual(chain_lookups(uom), None)
+        warehouse.add_value('name', 'Stock warehouse')
+        self.assertEqual(chain_lookups(warehouse), None)
+
+    def test_resolve(self):
+        """ Keys map to the rows matching them, in one query """
+        stock = Warehouse.objects.get(country__code='Stock')
+        self.assertEqual(resolve(Warehouse, ('country__code', ),
+                                 [('Stock', ), ('Stock', ), ('Sold', )]),
+                         {('Stock', ): [stock.pk]})
+
+    def test_date_chain(self):
+        """ A date cleaned to a datetime matches the date in the database """
+        item = Item.objects.create(
+            code_share='tent', code_org='RF024',
+            uom=UnitOfMeasure.objects.create(name='Set'),
+            organisation=Organisation.objects.create(name='Save UK'),
+            country=Country.objects.get(code='Stock'))
+        today = date.today()
+        stocktake = TempModel(Stocktake)
+        stocktake.add_fk('item').add_value('date',
+                                           today.strftime('%d/%m/%Y'))
+        lookups, key = chain_lookups(stocktake)
+        self.assertEqual((lookups, key), (('item__date', ), (today, )))
+        self.assertEqual(resolve(Item, ('date', ), [key]),
+                         {key: [item.pk]})
+
+    def test_join_import(self):
+        """ Deliveries link to existing warehouses, and rows with no
+            warehouse are logged rather than creating the chain
+        """
+        log = run_import('test_plain.csv', modelname='tests.Delivery',
+                         mappings=DELIVERY_MAPPINGS, join_fks=True)
+        self.assertTrue('Row 2: no Warehouse rows match'
+                        ' country__code=ETA 10-AUG-2011' in log)
+        self.assertEqual(Delivery.objects.count(), 7)
+        self.assertEqual(Delivery.objects.filter(
+            warehouse__country__code='On Order').count(), 2)
+        self.assertEqual(Warehouse.objects.count(), 2)
+        self.assertEqual(Country.objects.count(), 2)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from hashlib import md5
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from csvimport.keylocks import KeyLocks, lock_id
+from csvimport.models import ImportLock
+from csvimport.tests.models import Item, UnitOfMeasure
+from csvimport.tests.utils import ITEM_MAPPINGS, run_import, setup_import
+
+class RacingLocks(KeyLocks):
+    """ Another import creates the Set unit while its lock is waited on """
+
+    def acquire(self, key):
+        if key == SET_KEY:
+            UnitOfMeasure.objects.create(name='Set')
+        KeyLocks.acquire(self, key)
+
+SET_KEY = md5(repr(('tests', 'UnitOfMeasure',
+                   [('name__exact', u'Set')]))).digest()
+
+class DeadlockingLocks(KeyLocks):
+    """ Locking the Set unit deadlocks the first deadlocks times """
+
+    def __init__(self, deadlocks, using='default'):
+        KeyLocks.__init__(self, using)
+        self.deadlocks = deadlocks
+
+    def acquire(self, key):
+        if key == SET_KEY and self.deadlocks:
+            self.deadlocks -= 1
+            raise DatabaseError('deadlock detected')
+        KeyLocks.acquire(self, key)
+
+class KeyLocksTest(TestCase):
+    """ Test rows to create are matched again once their key is locked """
+
+    def test_acquire(self):
+        """ The lock table is left empty and a key can be locked twice """
+        locks = KeyLocks()
+        locks.acquire('k' * 16)
+        locks.acquire('k' * 16)
+        self.assertEqual(locks.acquired, 2)
+        self.assertEqual(ImportLock.objects.count(), 0)
+        self.assertEqual(lock_id('\xff' * 8), -1)
+
+    def test_locked_import(self):
+        """ Only rows that are created take a lock """
+        log = run_import('test_plain.csv', modelname='tests.Item',
+                         mappings=ITEM_MAPPINGS, lock_keys=True)
+        self.assertEqual(Item.objects.count(), 8)
+        self.assertEqual(UnitOfMeasure.objects.count(), 4)
+        self.assertTrue('Locked 16 match keys of rows to create' in log)
+
+    def test_created_while_locking(self):
+        """ A row created by another import is matched, not duplicated """
+        cmd = setup_import('test_plain.csv', modelname='tests.Item',
+                           mappings=ITEM_MAPPINGS, lock_keys=True)
+        cmd.key_locks = RacingLocks()
+        cmd.run(logid=1)
+        self.assertEqual(UnitOfMeasure.objects.filter(name='Set').count(), 1)
+        self.assertEqual(Item.objects.filter(uom__name='Set').count(), 2)
+
+    def locked_run(self, deadlocks):
+        cmd = setup_import('test_plain.csv', modelname='tests.Item',
+                           mappings=ITEM_MAPPINGS, lock_keys=True)
+        cmd.key_locks = DeadlockingLocks(deadlocks)
+        cmd.lock_backoff = 0
+        return cmd.run(logid=1)
+
+    def test_deadlock_retried(self):
+        """ A row that deadlocks is retried until it is saved """
+        log = self.locked_run(3)
+        self.assertTrue('Rows 1 to 1 rolled back on lock wait (deadlock'
+                        ' detected) so retrying each row' in log)
+        self.assertEqual(Item.objects.count(), 8)
+        self.assertEqual(UnitOfMeasure.objects.filter(name='Set').count(), 1)
+
+    def test_deadlock_not_saved(self):
+        """ A row that keeps deadlocking is logged and the import goes on """
+        log = self.locked_run(100)
+        self.assertEqual([msg for msg in log if 'not saved' in msg],
+                         ['Instance 1 not saved (deadlock detected)',
+                          'Instance 2 not saved (deadlock detected)'])
+        self.assertEqual(Item.objects.count(), 6)
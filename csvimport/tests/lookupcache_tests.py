@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from csvimport import lookupcache
+from csvimport.lookupcache import get_lookup_cache
+from csvimport.tests.models import Item, Organisation, UnitOfMeasure, \
+     Warehouse
+from csvimport.tests.utils import ITEM_MAPPINGS, run_import
+
+class LookupCacheTest(TestCase):
+    """ Test foreign key matches are cached across imports """
+
+    def setUp(self):
+        get_lookup_cache('default').clear()
+
+    def cache_log(self, log):
+        return [line for line in log if line.startswith('Lookup cache')]
+
+    def test_warm_import(self):
+        """ A second import resolves every foreign key from the cache
+            without querying or saving the rows
+        """
+        log = run_import('test_plain.csv', modelname='tests.Item',
+                         mappings=ITEM_MAPPINGS, lookup_cache='default')
+        # rows repeated within the file are cached as they are saved
+        self.assertEqual(self.cache_log(log),
+                         ['Lookup cache resolved 16 of 24 foreign keys'])
+        self.assertEqual(Item.objects.count(), 8)
+        log = run_import('test_plain.csv', modelname='tests.Item',
+                         mappings=ITEM_MAPPINGS, lookup_cache='default')
+        self.assertEqual(self.cache_log(log),
+                         ['Lookup cache resolved 24 of 24 foreign keys'])
+        self.assertEqual(Organisation.objects.count(), 1)
+        self.assertEqual(UnitOfMeasure.objects.count(), 4)
+        self.assertEqual(Item.objects.filter(uom__name='Set').count(), 2)
+
+    def test_invalidate(self):
+        """ Saving or deleting a cached row clears its entries """
+        run_import('test_plain.csv', modelname='tests.Item',
+                   mappings=ITEM_MAPPINGS, lookup_cache='default')
+        org = Organisation.objects.get()
+        org.name = 'Save the Children UK'
+        org.save()
+        UnitOfMeasure.objects.get(name='Kit').delete()
+        log = run_import('test_plain.csv', modelname='tests.Item',
+                         mappings=ITEM_MAPPINGS, lookup_cache='default')
+        # the renamed organisation and kit are matched again on the
+        # first row that has them, then cached
+        self.assertEqual(self.cache_log(log),
+                         ['Lookup cache resolved 22 of 24 foreign keys'])
+        self.assertEqual(sorted(Organisation.objects.values_list('name',
+                                                                 flat=True)),
+                         [u'Save UK', u'Save the Children UK'])
+        self.assertTrue(UnitOfMeasure.objects.filter(name='Kit').exists())
+        # without a cache nothing is logged
+        log = run_import('test_plain.csv', modelname='tests.Item',
+                         mappings=ITEM_MAPPINGS)
+        self.assertEqual(self.cache_log(log), [])
+
+    def test_connected_models(self):
+        """ Only models cached clear entries as they are saved, including
+            by raw saves
+        """
+        run_import('test_plain.csv', modelname='tests.Item',
+                   mappings=ITEM_MAPPINGS, lookup_cache='default')
+        self.assertTrue(UnitOfMeasure in lookupcache._connected)
+        self.assertFalse(Warehouse in lookupcache._connected)
+        # raw saves of the units, which match and update all four
+        run_import('test_plain.csv', modelname='tests.UnitOfMeasure',
+                   mappings='column5=name', raw='tests.UnitOfMeasure')
+        log = run_import('test_plain.csv', modelname='tests.Item',
+                         mappings=ITEM_MAPPINGS, lookup_cache='default')
+        # each unit is matched again on its first row
+        self.assertEqual(self.cache_log(log),
+                         ['Lookup cache resolved 20 of 24 foreign keys'])
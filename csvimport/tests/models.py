@@ -55,3 +55,20 @@ class Item(models.Model):
     country = models.ForeignKey(Country)
 
 
+
+class Warehouse(models.Model):
+    """ One per country, for chains of foreign keys """
+    name = models.CharField(max_length=255)
+    country = models.ForeignKey(Country)
+
+    def __unicode__(self):
+        return self.name
+
+class Delivery(models.Model):
+    warehouse = models.ForeignKey(Warehouse)
+    uom = models.ForeignKey(UnitOfMeasure)
+    quantity = models.PositiveIntegerField(default=1)
+
+class Stocktake(models.Model):
+    """ For chains of foreign keys ending in a date """
+    item = models.ForeignKey(Item)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from django.test import TestCase
+
+from csvimport.pipeline import Pipeline
+from csvimport.tests.models import Country
+from csvimport.tests.utils import run_import, setup_import
+
+class PipelineTest(TestCase):
+    """ Test the threaded pipeline import matches the sequential one """
+
+    def test_stages(self):
+        """ Stages run in order and keep the row order """
+        pipeline = Pipeline(xrange(1000), [lambda x: x + 1, str], maxsize=5)
+        self.assertEqual(list(pipeline), [str(i + 1) for i in xrange(1000)])
+
+    def test_stage_error(self):
+        """ An error in a stage thread is raised in the caller """
+        def fail(item):
+            if item == 3:
+                raise ValueError('bad row')
+            return item
+        pipeline = Pipeline(xrange(10), [fail], maxsize=2)
+        self.assertRaises(ValueError, list, pipeline)
+
+    def test_pipeline_import(self):
+        """ Pipelined import gives the same rows and log as sequential,
+            with the rows cleaned in a thread of their own
+        """
+        errors = run_import('countries.csv')
+        countries = list(Country.objects.order_by('code').values_list())
+        Country.objects.all().delete()
+        cmd = setup_import('countries.csv', pipeline=True, queuesize=10)
+        threads = set()
+        row_tree = cmd.row_tree
+
+        def traced(*args):
+            threads.add(threading.current_thread().name)
+            return row_tree(*args)
+
+        cmd.row_tree = traced
+        piped = cmd.run(logid=1)
+        self.assertEqual(piped, errors)
+        self.assertEqual(list(Country.objects.order_by('code').values_list()),
+                         countries)
+        self.assertEqual(len(threads), 1)
+        self.assertFalse(threading.current_thread().name in threads)
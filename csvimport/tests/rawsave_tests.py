@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from django.db.models.signals import pre_save, post_save
+from django.test import TestCase
+
+from csvimport.rawsave import raw_save
+from csvimport.signals import batch_saved
+from csvimport.tests.models import Country, UnitOfMeasure
+from csvimport.tests.utils import run_import
+
+class RawSaveTest(TestCase):
+    """ Test saving without save() and signals, with batch signals """
+
+    def setUp(self):
+        self.signals = []
+        pre_save.connect(self.receiver, sender=UnitOfMeasure)
+        post_save.connect(self.receiver, sender=UnitOfMeasure)
+        batch_saved.connect(self.batch_receiver, sender=UnitOfMeasure)
+
+    def tearDown(self):
+        pre_save.disconnect(self.receiver, sender=UnitOfMeasure)
+        post_save.disconnect(self.receiver, sender=UnitOfMeasure)
+        batch_saved.disconnect(self.batch_receiver, sender=UnitOfMeasure)
+
+    def receiver(self, sender, instance, **kwargs):
+        self.signals.append(instance.name)
+
+    def batch_receiver(self, sender, instances, created, **kwargs):
+        self.signals.append(([uom.name for uom in instances], created))
+
+    def test_raw_save(self):
+        """ Rows are inserted, or updated if they have a pk """
+        uom = UnitOfMeasure(name='Kit')
+        self.assertTrue(raw_save(uom))
+        self.assertTrue(uom.pk)
+        uom.name = 'Set'
+        self.assertFalse(raw_save(uom))
+        self.assertEqual(UnitOfMeasure.objects.get(pk=uom.pk).name, 'Set')
+        country = Country(code='KE', name='Kenya')
+        self.assertTrue(raw_save(country))
+        self.assertFalse(raw_save(country))
+        self.assertEqual(Country.objects.count(), 1)
+        self.assertEqual(self.signals, [])
+
+    def test_raw_import(self):
+        """ Only batch signals are sent, once per batch """
+        run_import('test_plain.csv', modelname='tests.UnitOfMeasure',
+                   mappings='column5=name', raw='tests.UnitOfMeasure',
+                   batchsize=4)
+        self.assertEqual(self.signals,
+                         [([u'Set', u'Set', u'Kit', u'Piece(s)'],
+                           [True, False, True, True]),
+                          ([u'Piece(s)', u'Metre', u'Piece(s)', u'Piece(s)'],
+                           [False, True, False, False])])
+        self.assertEqual(UnitOfMeasure.objects.count(), 4)
+        self.signals = []
+        UnitOfMeasure.objects.all().delete()
+        run_import('test_plain.csv', modelname='tests.UnitOfMeasure',
+                   mappings='column5=name')
+        self.assertEqual(len(self.signals), 8 * 4)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+from datetime import datetime
+
+from django.test import TestCase
+from django.utils import unittest
+
+from csvimport import readers
+from csvimport.management.commands import csvimport as command
+from csvimport.readers import CSVReader, ArrowReader, XLSXReader, \
+     JSONLinesReader, FixedWidthReader, get_reader, NoSuchReader
+from csvimport.tests.models import Country, UnitOfMeasure
+from csvimport.tests.utils import fixture, run_import
+
+PLAIN_WIDTHS = '12,10,14,62,10,10,17'
+
+arrow_csv = readers.optional_module('pyarrow.csv')
+openpyxl = readers.optional_module('openpyxl')
+
+def reader_import(filename, **options):
+    """ Run the import returning its log and the names of the readers
+        the command used
+    """
+    used = []
+
+    def recording(*args, **kwargs):
+        reader = get_reader(*args, **kwargs)
+        used.append(reader.name)
+        return reader
+
+    command.get_reader = recording
+    try:
+        log = run_import(filename, **options)
+    finally:
+        command.get_reader = get_reader
+    return log, used
+
+class ReaderTest(TestCase):
+    """ Test the reader backends give the same rows """
+
+    def test_csv_reader(self):
+        """ Rows are lists of unicode cells in batches """
+        reader = CSVReader(fixture('test_char2.csv'))
+        rows = list(reader)
+        self.assertEqual(rows[0][0], u'CODE_SHARE')
+        self.assertEqual(rows[4][4], u'删除当前图片')
+        batches = list(CSVReader(fixture('test_char2.csv'),
+                                 batchsize=2).batches())
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(sum(batches, []), rows)
+
+    def test_detect_charset(self):
+        """ The charset is guessed from the start of the file only """
+        self.assertEqual(CSVReader(fixture('test_char2.csv')).charset,
+                         'utf-8')
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.write(handle, 'name\n' + 'Kit\n' * 300 + 'Caf\xe9\n')
+        os.close(handle)
+        sample = readers.CHARSET_SAMPLE, readers.CHARSET_BLOCK
+        readers.CHARSET_SAMPLE, readers.CHARSET_BLOCK = 1024, 256
+        try:
+            # the latin-1 cell is past the sample
+            self.assertEqual(CSVReader(path).charset, 'utf-8')
+            self.assertEqual(JSONLinesReader(path).charset, 'utf-8')
+        finally:
+            readers.CHARSET_SAMPLE, readers.CHARSET_BLOCK = sample
+            os.remove(path)
+
+    def test_get_reader(self):
+        """ Unknown readers are an error, arrow falls back to csv """
+        self.assertRaises(NoSuchReader, get_reader,
+                          fixture('test_plain.csv'), backend='xml')
+        reader = get_reader(fixture('test_plain.csv'), backend='auto')
+        if arrow_csv is None:
+            self.assertEqual(reader.name, 'csv')
+        else:
+            self.assertEqual(reader.name, 'arrow')
+
+    @unittest.skipIf(arrow_csv is None, 'pyarrow is not installed')
+    def test_arrow_reader(self):
+        """ Arrow gives the same rows as the csv module for each charset """
+        for filename in ('test_plain.csv', 'test_char2.csv', 'countries.csv'):
+            expected = list(CSVReader(fixture(filename)))
+            reader = ArrowReader(fixture(filename))
+            self.assertEqual(list(reader), expected)
+
+    @unittest.skipIf(arrow_csv is None, 'pyarrow is not installed')
+    def test_arrow_ragged(self):
+        """ Rows with more or fewer cells than the header are given as
+            the csv reader gives them
+        """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.write(handle, 'name,code\nKit,1\nSet,2,3\nBox\n\nMetre,4\n')
+        os.close(handle)
+        try:
+            expected = list(CSVReader(path))
+            self.assertEqual(expected[2], [u'Set', u'2', u'3'])
+            self.assertEqual(list(ArrowReader(path, batchsize=2)), expected)
+        finally:
+            os.remove(path)
+
+    @unittest.skipIf(arrow_csv is None, 'pyarrow is not installed')
+    def test_arrow_import(self):
+        """ The arrow reader imports the countries as the csv one does """
+        errors = run_import('countries.csv')
+        countries = list(Country.objects.order_by('code').values_list())
+        Country.objects.all().delete()
+        arrow, used = reader_import('countries.csv', reader='arrow')
+        self.assertEqual(used, ['arrow'])
+        self.assertEqual(arrow, errors)
+        self.assertEqual(list(Country.objects.order_by('code').values_list()),
+                         countries)
+
+    def test_streamed_readers(self):
+        """ JSON Lines and fixed width files give the csv rows """
+        expected = list(CSVReader(fixture('test_plain.csv')))
+        self.assertEqual(list(JSONLinesReader(fixture('test_plain.jsonl'))),
+                         expected)
+        reader = get_reader(fixture('test_plain.txt'), backend='fixed',
+                            widths=PLAIN_WIDTHS)
+        self.assertEqual(list(reader), expected)
+        self.assertRaises(NoSuchReader, list,
+                          FixedWidthReader(fixture('test_plain.txt')))
+        self.assertEqual(get_reader(fixture('test_plain.jsonl'),
+                                    backend='auto').name, 'jsonl')
+
+    def test_streamed_import(self):
+        """ Streamed readers import as the csv reader does """
+        run_import('test_plain.csv', modelname='tests.UnitOfMeasure')
+        expected = list(UnitOfMeasure.objects.values_list('name', flat=True))
+        for filename, name, options in (
+                ('test_plain.jsonl', 'jsonl', {'reader': 'auto'}),
+                ('test_plain.txt', 'fixed', {'reader': 'fixed',
+                                             'widths': PLAIN_WIDTHS})):
+            UnitOfMeasure.objects.all().delete()
+            log, used = reader_import(filename,
+                                      modelname='tests.UnitOfMeasure',
+                                      **options)
+            self.assertEqual(used, [name])
+            self.assertEqual(list(UnitOfMeasure.objects.values_list(
+                'name', flat=True)), expected)
+
+    @unittest.skipIf(openpyxl is None, 'openpyxl is not installed')
+    def test_xlsx_reader(self):
+        """ Workbook cells are given as the csv reader would give them """
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = 'Items'
+        rows = list(CSVReader(fixture('test_plain.csv')))
+        for row in rows:
+            sheet.append(row)
+        sheet.append([])
+        sheet.append([u'tent', 17.5, 15, datetime(2012, 3, 7), None])
+        handle, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(handle)
+        try:
+            workbook.save(path)
+            reader = get_reader(path, backend='auto')
+            self.assertEqual(reader.name, 'xlsx')
+            self.assertEqual(list(reader), rows +
+                             [[u'tent', u'17.5', u'15', u'07/03/2012', u'',
+                               u'', u'']])
+            self.assertEqual(len(list(XLSXReader(path, sheet='Items'))), 10)
+        finally:
+            os.remove(path)
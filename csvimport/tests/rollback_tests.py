@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from csvimport.management.commands.csvimport import Command
+from csvimport.lookupcache import get_lookup_cache
+from csvimport.models import CSVImport, ImportModel
+from csvimport.tests.models import Country, Item, Organisation, UnitOfMeasure
+from csvimport.tests.utils import ITEM_MAPPINGS, fixture, run_import
+
+class RollbackTest(TestCase):
+    """ Test journalled imports can be rolled back """
+
+    def journal_import(self, filename, **options):
+        msg = Command().handle_label(fixture(filename), journal=True,
+                                     **options)
+        return CSVImport.objects.get(file_name=fixture(filename)), msg
+
+    def test_rollback(self):
+        """ Updated rows are restored and created rows deleted """
+        Country.objects.create(code='AF', name='Afghan', latitude=1)
+        csvimport, msg = self.journal_import('countries.csv',
+                                             model='tests.Country')
+        self.assertEqual(msg, 'Journalled as import %s, roll it back with'
+                              ' --rollback %s' % (csvimport.id, csvimport.id))
+        self.assertEqual(Country.objects.get(code='AF').name, 'AFGHANISTAN')
+        self.assertTrue(Country.objects.count() > 200)
+        before = ImportModel.objects.get(created=False).before_image
+        self.assertEqual(before, '{"alias": null, "latitude": 1.0,'
+                                 ' "longitude": null, "name": "Afghan"}')
+        msg = Command().handle_label(str(csvimport.id), rollback=True)
+        self.assertTrue(msg.startswith('Rolled back import %s, restoring 1'
+                                       ' updated rows' % csvimport.id))
+        country = Country.objects.get()
+        self.assertEqual((country.name, country.latitude), ('Afghan', 1))
+        self.assertEqual(ImportModel.objects.count(), 0)
+        self.assertTrue(msg in CSVImport.objects.get(pk=csvimport.id).error_log)
+
+    def test_repeated_key(self):
+        """ Fields changed by later rows for a key are restored too """
+        Country.objects.create(code='KE', name='Kenya', latitude=1)
+        csvimport, msg = self.journal_import('test_repeated.csv',
+                                             model='tests.Country')
+        country = Country.objects.get()
+        self.assertEqual((country.name, country.latitude), ('KENYA', 5))
+        self.assertEqual(sorted(ImportModel.objects.values_list(
+            'before_image', flat=True)), ['{"latitude": 1.0}',
+                                          '{"name": "Kenya"}'])
+        Command().handle_label(str(csvimport.id), rollback=True)
+        country = Country.objects.get()
+        self.assertEqual((country.name, country.latitude), ('Kenya', 1))
+
+    def test_batched_rollback(self):
+        """ Rows and their foreign keys from batches are all deleted,
+            leaving rows the import only matched
+        """
+        UnitOfMeasure.objects.create(name='Kit')
+        csvimport, msg = self.journal_import('test_plain.csv',
+                                             model='tests.Item',
+                                             mappings=ITEM_MAPPINGS,
+                                             batchsize=3)
+        self.assertEqual(Item.objects.count(), 8)
+        # rows created then matched are only journalled once
+        self.assertEqual(ImportModel.objects.filter(model_name='tests.Item',
+                                                    created=True).count(), 8)
+        msg = Command().handle_label(str(csvimport.id), rollback=True)
+        self.assertEqual(msg, 'Rolled back import %s, restoring 0 updated'
+                              ' rows and deleting 15 created rows' %
+                              csvimport.id)
+        self.assertEqual(Item.objects.count(), 0)
+        self.assertEqual(Organisation.objects.count(), 0)
+        self.assertEqual(list(UnitOfMeasure.objects.values_list('name',
+                                                                flat=True)),
+                         [u'Kit'])
+        self.assertEqual(Command().handle_label('0', rollback=True),
+                         'There is no import 0 to roll back')
+
+    def test_rollback_clears_cache(self):
+        """ Rows rolled back are dropped from the lookup cache """
+        get_lookup_cache('default').clear()
+        csvimport, msg = self.journal_import('test_plain.csv',
+                                             model='tests.Item',
+                                             mappings=ITEM_MAPPINGS,
+                                             lookup_cache='default')
+        Command().handle_label(str(csvimport.id), rollback=True)
+        log = run_import('test_plain.csv', modelname='tests.Item',
+                         mappings=ITEM_MAPPINGS, lookup_cache='default')
+        # as cold an import as the first
+        self.assertTrue('Lookup cache resolved 16 of 24 foreign keys' in log)
+        self.assertEqual(Item.objects.count(), 8)
+
+    def test_referred_to(self):
+        """ Created rows that other rows refer to stop the rollback """
+        csvimport, msg = self.journal_import('test_plain.csv',
+                                             model='tests.UnitOfMeasure',
+                                             mappings='column5=name')
+        item = Item.objects.create(
+            code_share='tent', code_org='RF024',
+            uom=UnitOfMeasure.objects.get(name='Set'),
+            organisation=Organisation.objects.create(name='Save UK'),
+            country=Country.objects.create(code='KE', name='Kenya'))
+        msg = Command().handle_label(str(csvimport.id), rollback=True)
+        self.assertEqual(msg.split('\n'), [
+            '1 Item rows refer to UnitOfMeasure rows the import created by'
+            ' uom, eg. %s' % item.pk,
+            'Import %s was not rolled back, as rows it created are still'
+            ' referred to' % csvimport.id])
+        self.assertEqual(UnitOfMeasure.objects.count(), 4)
+        self.assertEqual(ImportModel.objects.count(), 4)
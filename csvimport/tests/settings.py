@@ -10,6 +10,11 @@ DATABASES = {
         'PASSWORD': '', # Not used with sqlite3.
         'HOST': '',     # Set to empty string for localhost. 
         'PORT': '',     # Set to empty string for default. 
+    },
+    # Separate database to test lookups on a replica
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': '/tmp/django-csvimport-test-replica.db',
     }
 }
 
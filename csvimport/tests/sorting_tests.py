@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import random
+
+from django.db.models.signals import post_save
+from django.test import TestCase
+
+from csvimport.sorting import ExternalSort
+from csvimport.tests.models import Country, Item
+from csvimport.tests.utils import ITEM_MAPPINGS, run_import
+
+class OpenFilesSort(ExternalSort):
+    """ Note the most spill files open at once """
+
+    def __init__(self, *args, **kwargs):
+        ExternalSort.__init__(self, *args, **kwargs)
+        self.spillfiles = []
+        self.most_open = 0
+
+    def open_spill(self):
+        spillfile = ExternalSort.open_spill(self)
+        self.spillfiles.append(spillfile)
+        self.most_open = max(self.most_open, len(
+            [spillfile for spillfile in self.spillfiles
+             if not spillfile.closed]))
+        return spillfile
+
+class SortingTest(TestCase):
+    """ Test the external sort and sorted imports """
+
+    def test_external_sort(self):
+        """ Spilling to disk gives the same stable order as sorted """
+        items = [(i, [unicode(random.randint(0, 50))]) for i in range(500)]
+        key = lambda item: item[1]
+        sorter = ExternalSort(key, buffersize=2000)
+        self.assertEqual(list(sorter.sort(items)), sorted(items, key=key))
+        self.assertTrue(sorter.runs > 10)
+        in_memory = ExternalSort(key)
+        self.assertEqual(list(in_memory.sort(items)), sorted(items, key=key))
+        self.assertEqual(in_memory.runs, 0)
+
+    def test_merge_width(self):
+        """ Runs are merged a few at a time, so few files are open """
+        items = [(i, [unicode(random.randint(0, 50))]) for i in range(500)]
+        key = lambda item: item[1]
+        sorter = OpenFilesSort(key, buffersize=0, mergewidth=4)
+        self.assertEqual(list(sorter.sort(items)), sorted(items, key=key))
+        self.assertEqual(sorter.runs, 500)
+        # 500 runs take 4 passes, with up to 3 runs waiting after each
+        self.assertTrue(sorter.merges > 125)
+        self.assertTrue(sorter.most_open <= 3 * 4 + 2)
+        self.assertEqual([spillfile for spillfile in sorter.spillfiles
+                          if not spillfile.closed], [])
+
+    def test_sorted_import(self):
+        """ Rows sorted by the unique code give the same countries,
+            saved in code order rather than file order
+        """
+        errors = run_import('countries.csv')
+        countries = list(Country.objects.order_by('code').values_list())
+        Country.objects.all().delete()
+        saved = []
+
+        def record(sender, instance, **kwargs):
+            saved.append(instance.code)
+
+        post_save.connect(record, sender=Country)
+        try:
+            sorted_errors = run_import('countries.csv', sortby='unique',
+                                       sortbuffer=0)
+        finally:
+            post_save.disconnect(record, sender=Country)
+        self.assertEqual(sorted_errors[1], 'Sorting rows by column 2 before saving')
+        self.assertEqual(list(Country.objects.order_by('code').values_list()),
+                         countries)
+        self.assertEqual(sorted(sorted_errors[2:]), sorted(errors[1:]))
+        self.assertEqual(saved, sorted(saved))
+        self.assertEqual(sorted(set(saved)), [row[0] for row in countries])
+
+    def test_numeric_key(self):
+        """ Numbers are sorted as numbers, not as their strings """
+        errors = run_import('test_plain.csv', modelname='tests.Item',
+                            mappings=ITEM_MAPPINGS + ',column6=quantity',
+                            sortby='quantity')
+        self.assertEqual(errors[1], 'Sorting rows by column 6 before saving')
+        self.assertEqual(list(Item.objects.order_by('pk').values_list(
+            'quantity', flat=True)), [15, 45, 55, 300, 500, 1800, 3000, 12000])
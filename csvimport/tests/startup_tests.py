@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import subprocess
+
+from django.test import TestCase
+
+from csvimport.models import CSVImport, LazyModelChoices
+
+# Seconds allowed for importing the csvimport package modules
+# once django itself is imported
+STARTUP_BUDGET = 0.5
+
+STARTUP_SCRIPT = """
+from django.conf import settings
+settings.configure(INSTALLED_APPS=('csvimport', ), MEDIA_ROOT='/tmp')
+import time
+from django.db import models
+from django.core import management
+start = time.time()
+import csvimport.models
+import csvimport.management
+import csvimport.management.commands.csvimport
+print time.time() - start
+print models.loading.cache.loaded
+print management._commands is None
+import sys
+print 'pyarrow' in sys.modules or 'openpyxl' in sys.modules
+"""
+
+class StartupTest(TestCase):
+    """ Check importing csvimport stays cheap """
+
+    def test_lazy_choices(self):
+        """ Model choices are only resolved when iterated """
+        choices = LazyModelChoices()
+        self.assertEqual(choices._choices, None)
+        self.assertTrue(('tests.Country', 'tests.Country') in list(choices))
+        self.assertFalse(('contenttypes.ContentType',
+                          'contenttypes.ContentType') in list(choices))
+        field = CSVImport._meta.get_field('model_name')
+        self.assertTrue(('tests.Item', 'tests.Item') in field.get_choices())
+
+    def test_startup_budget(self):
+        """ Import in a fresh interpreter and confirm no models, commands
+            or optional readers are loaded, within the time budget
+        """
+        path = os.path.dirname(os.path.dirname(os.path.dirname(
+                               os.path.abspath(__file__))))
+        env = dict(os.environ)
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+        env['PYTHONPATH'] = os.pathsep.join([path] + sys.path)
+        proc = subprocess.Popen([sys.executable, '-c', STARTUP_SCRIPT],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env)
+        out, err = proc.communicate()
+        self.assertEqual(proc.returncode, 0, err)
+        elapsed, loaded, no_commands, readers = out.split()
+        self.assertEqual(loaded, 'False')
+        self.assertEqual(no_commands, 'True')
+        self.assertEqual(readers, 'False')
+        self.assertTrue(float(elapsed) < STARTUP_BUDGET,
+                        'Import took %ss, budget is %ss' % (elapsed,
+                                                            STARTUP_BUDGET))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from csvimport.management.commands.csvimport import order_targets
+from csvimport.tests.models import Country, UnitOfMeasure, Item, Organisation
+from csvimport.tests.utils import ITEM_MAPPINGS, run_import
+
+class TargetsTest(TestCase):
+    """ Test importing each row to several models in one pass """
+
+    def test_order_targets(self):
+        """ Models with fks to other targets come after them """
+        targets = [(Item, []), (Organisation, []), (Country, []),
+                   (UnitOfMeasure, [])]
+        ordered = [model for model, mappings in order_targets(targets)]
+        self.assertEqual(ordered, [Organisation, Country, UnitOfMeasure,
+                                   Item])
+
+    def test_targets_import(self):
+        """ Each target gets its own columns from the one read of the file """
+        errors = run_import('test_plain.csv', modelname='tests.Item',
+                            mappings=ITEM_MAPPINGS,
+                            targets=['tests.UnitOfMeasure:column5=name',
+                                     'tests.Organisation:column3=name'],
+                            batchsize=3)
+        self.assertEqual(errors[:2], ['Using manually entered mapping list',
+                                      'Importing to UnitOfMeasure, '
+                                      'Organisation, Item'])
+        self.assertEqual(list(Organisation.objects.values_list('name',
+                                                               flat=True)),
+                         [u'Save UK'])
+        self.assertEqual(sorted(UnitOfMeasure.objects.values_list('name',
+                                                                  flat=True)),
+                         [u'Kit', u'Metre', u'Piece(s)', u'Set'])
+        # the model is imported as the first target, after its parents
+        self.assertEqual(Item.objects.count(), 8)
+        self.assertEqual(Item.objects.filter(uom__name='Set').count(), 2)
+
+    def test_header_mappings(self):
+        """ The model is mapped from the header row without mappings """
+        errors = run_import('countries.csv', modelname='tests.Country',
+                            targets=['tests.UnitOfMeasure:column2=name'])
+        self.assertEqual(errors[:2], ['Using mapping from first row of CSV file',
+                                      'Importing to Country, UnitOfMeasure'])
+        self.assertEqual(Country.objects.count(),
+                         UnitOfMeasure.objects.count())
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+""" Helpers shared by the test modules """
+import os
+
+from csvimport.management.commands.csvimport import Command
+from csvimport.tests.parse_tests import DummyFileObj
+
+# Items of test_plain.csv with their organisation, unit and country
+ITEM_MAPPINGS = ('column1=code_share,column2=code_org,'
+                 'column3=organisation.name,column5=uom.name,'
+                 'column7=country.code')
+
+def fixture(filename):
+    return os.path.join(os.path.dirname(__file__), 'fixtures', filename)
+
+def setup_import(filename, modelname='tests.Country', mappings='', **kwargs):
+    """ A command set up to import a fixtures file """
+    cmd = Command()
+    uploaded = DummyFileObj()
+    uploaded.set_path(filename)
+    cmd.setup(mappings=mappings, modelname=modelname, charset='',
+              uploaded=uploaded, **kwargs)
+    return cmd
+
+def run_import(filename, modelname='tests.Country', mappings='', **kwargs):
+    """ Run the import of a fixtures file returning its log """
+    return setup_import(filename, modelname, mappings, **kwargs).run(logid=1)